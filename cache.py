@@ -0,0 +1,107 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+from flask import Flask
+from threading import Lock
+from typing import (
+    Hashable,
+    Optional,
+    Tuple)
+
+
+class ResponseCache:
+    """In-memory cache of serialized response bodies, and the content encoding they're compressed with, evicting the
+    least recently used once it's over its size limit.
+
+    Each body is stored with the version it was built from. Looking it up with any other version misses, so bumping a
+    version in the database is enough to invalidate it, whichever process did the writing.
+    """
+
+    def __init__(self, max_size: int = 0):
+        """Constructor.
+
+        :param max_size: The most bytes of bodies to hold, 0 to turn the cache off.
+        """
+
+        self.max_size: int = max_size
+        self.size: int = 0
+        self.bodies: OrderedDict = OrderedDict()
+        self.lock: Lock = Lock()
+
+    def init_app(self, app: Flask) -> None:
+        """Configures the cache from the application's TIMELINE_CACHE_SIZE.
+
+        :param app: The application.
+        """
+
+        self.max_size = app.config['TIMELINE_CACHE_SIZE']
+
+    def get(self, key: Hashable, version: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Gets a cached body.
+
+        :param key: The key the body was stored under.
+        :param version: The version the body needs to have been built from.
+        :return: The body and its content encoding, or None if it isn't cached or is out of date.
+        """
+
+        with self.lock:
+            cached: Optional[Tuple[str, bytes, Optional[str]]] = self.bodies.get(key)
+            if cached is None:
+                return None
+
+            # out of date, it'll never be asked for again
+            cached_version, body, encoding = cached
+            if cached_version != version:
+                self.remove(key)
+                return None
+
+            self.bodies.move_to_end(key)
+            return body, encoding
+
+    def put(self, key: Hashable, version: str, body: bytes, encoding: Optional[str] = None) -> None:
+        """Caches a body, evicting the least recently used ones if the cache is then too big.
+
+        :param key: The key to store the body under.
+        :param version: The version the body was built from.
+        :param body: The body.
+        :param encoding: The content encoding the body is compressed with, None if it isn't.
+        """
+
+        # bodies bigger than the whole cache would only evict everything else, then themselves
+        if len(body) > self.max_size:
+            return
+
+        with self.lock:
+            self.remove(key)
+            self.bodies[key] = (version, body, encoding)
+            self.size += len(body)
+
+            while self.size > self.max_size:
+                _, (_, evicted, _) = self.bodies.popitem(last=False)
+                self.size -= len(evicted)
+
+    def remove(self, key: Hashable) -> None:
+        """Removes a body from the cache, if it's there. The lock must be held.
+
+        :param key: The key the body was stored under.
+        """
+
+        cached: Optional[Tuple[str, bytes, Optional[str]]] = self.bodies.pop(key, None)
+        if cached is not None:
+            self.size -= len(cached[1])
+
+
+timeline_cache: ResponseCache = ResponseCache()
@@ -15,11 +15,33 @@
 
 from click import (
     Argument,
-    Command)
-from typing import List
+    Command,
+    Option)
+from collections import Counter
+from flask import current_app
+from flask.cli import with_appcontext
+from typing import (
+    List,
+    Optional,
+    Union)
 
-from feeds import update_feeds
+from daemon import run_daemon
+from database import db
+from feeds import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_HOST_LIMIT,
+    DEFAULT_WORKERS,
+    update_feeds)
+from jobs import (
+    enqueue_job,
+    run_worker)
 from login import add_user
+from retention import prune_entries
+from search import rebuild_search_index
+from storage import (
+    maintain_storage,
+    migrate_storage)
+from timeline import rebuild_timelines
 
 
 def add_user_command(name: str, password: str) -> None:
@@ -38,10 +60,150 @@ params.append(arg)
 AddUserCommand: Command = Command('au', callback=add_user_command, params=params)
 
 
-def check_for_updates_command() -> None:
-    """Wrapper function for feed update command."""
+@with_appcontext
+def maintain_command(vacuum: bool) -> None:
+    """Wrapper function for database maintenance command.
 
-    update_feeds()
+    :param vacuum: Whether to rebuild the database file.
+    """
+
+    maintain_storage(db, current_app.config['SQLITE_PRAGMAS'], vacuum)
+
+
+option: Option = Option(('--vacuum',), is_flag=True, help='Also rebuild the database file to reclaim free space.')
+params: List[Option] = [option]
+MaintainCommand: Command = Command('mt', callback=maintain_command, params=params)
+
+
+@with_appcontext
+def migrate_command() -> None:
+    """Wrapper function for database migration command."""
+
+    migrate_storage(db, current_app.config['SQLITE_PRAGMAS'])
+
+
+MigrateCommand: Command = Command('mg', callback=migrate_command)
+
+
+@with_appcontext
+def prune_command(days: Optional[int], per_source: Optional[int], archive: Optional[str]) -> None:
+    """Wrapper function for entry pruning command. Limits that aren't given are taken from the configuration.
+
+    :param days: Delete entries last updated more than this many days ago. 0 to not limit by age.
+    :param per_source: Delete all but the newest this many entries of each source. 0 to not limit by count.
+    :param archive: Path of a gzip compressed file to append deleted entries to, empty to not archive.
+    """
+
+    config: dict = current_app.config
+    days = config['RETENTION_DAYS'] if days is None else days
+    per_source = config['RETENTION_PER_SOURCE'] if per_source is None else per_source
+    archive = config['RETENTION_ARCHIVE'] if archive is None else archive
+
+    deleted: int = prune_entries(db, days, per_source, archive)
+    print(f'{deleted} entries pruned.')
+
+
+option: Option = Option(('-d', '--days'), type=int, help='Delete entries older than this many days.')
+params: List[Option] = [option]
+option: Option = Option(('-n', '--per-source'), type=int, help='Keep only this many of the newest entries per source.')
+params.append(option)
+option: Option = Option(('--archive',), help='Append deleted entries to this gzip compressed file.')
+params.append(option)
+PruneCommand: Command = Command('pr', callback=prune_command, params=params)
+
+
+def rebuild_search_command() -> None:
+    """Wrapper function for search index rebuild command."""
+
+    rebuild_search_index(db)
+
+
+RebuildSearchCommand: Command = Command('rs', callback=rebuild_search_command)
+
+
+def rebuild_timelines_command() -> None:
+    """Wrapper function for materialized timeline rebuild command."""
+
+    rebuild_timelines(db)
+
+
+RebuildTimelinesCommand: Command = Command('rt', callback=rebuild_timelines_command)
+
+
+@with_appcontext
+def check_for_updates_command(workers: int, host_limit: int, everything: bool, batch_size: int, prune: bool,
+                              enqueue: bool, daemon: bool, status_file: Optional[str]) -> None:
+    """Wrapper function for feed update command.
+
+    :param workers: Number of feeds to fetch at the same time.
+    :param host_limit: Maximum number of feeds to fetch at the same time from any one host.
+    :param everything: Check every source, even the ones that aren't due yet.
+    :param batch_size: Number of sources to store per transaction.
+    :param prune: Whether to prune entries past the configured retention limits afterwards.
+    :param enqueue: Queue the update as a job for a worker, rather than running it now.
+    :param daemon: Keep running, checking sources as they fall due, until interrupted.
+    :param status_file: Path of the daemon's status file, taken from the configuration if not given.
+    """
+
+    config: dict = current_app.config
+
+    def prune_configured() -> int:
+        pruned: int = prune_entries(db, config['RETENTION_DAYS'], config['RETENTION_PER_SOURCE'],
+                                    config['RETENTION_ARCHIVE'])
+        return pruned
+
+    if daemon:
+        status_file = config['UPDATER_STATUS_FILE'] if status_file is None else status_file
+        run_daemon(status_file, workers, host_limit, batch_size, prune_configured if prune else None)
+        return
+
+    # leave the update to a worker
+    if enqueue:
+        job_id: int = enqueue_job('update', {'workers': workers, 'host_limit': host_limit, 'everything': everything,
+                                             'batch_size': batch_size})
+        print(f'Update queued as job {job_id}.')
+    else:
+        stats: Counter = update_feeds(workers, host_limit, everything, batch_size)
+        print(f'{stats["fetched"]} fetched, {stats["not_modified"]} not modified, {stats["failed"]} failed.')
+
+    if prune:
+        deleted: int = prune_configured()
+        print(f'{deleted} entries pruned.')
+
+
+option: Option = Option(('-w', '--workers'), default=DEFAULT_WORKERS, show_default=True, type=int,
+                        help='Number of feeds to fetch at the same time.')
+params: List[Union[Argument, Option]] = [option]
+option: Option = Option(('-l', '--host-limit'), default=DEFAULT_HOST_LIMIT, show_default=True, type=int,
+                        help='Maximum number of feeds to fetch at the same time from any one host.')
+params.append(option)
+option: Option = Option(('-a', '--all', 'everything'), is_flag=True, help='Check every source, even if not due yet.')
+params.append(option)
+option: Option = Option(('-b', '--batch-size'), default=DEFAULT_BATCH_SIZE, show_default=True, type=int,
+                        help='Number of sources to store per transaction.')
+params.append(option)
+option: Option = Option(('--prune',), is_flag=True, help='Prune entries past the retention limits afterwards.')
+params.append(option)
+option: Option = Option(('--enqueue',), is_flag=True, help='Queue the update for a worker, rather than running it now.')
+params.append(option)
+option: Option = Option(('--daemon',), is_flag=True, help='Keep running, checking sources as they fall due.')
+params.append(option)
+option: Option = Option(('--status-file',), help='Path of the status file written by --daemon.')
+params.append(option)
+UpdateCommand: Command = Command('up', callback=check_for_updates_command, params=params)
+
+
+@with_appcontext
+def worker_command(drain: bool) -> None:
+    """Wrapper function for job worker command.
+
+    :param drain: Stop once the queue is empty, rather than waiting for more jobs.
+    """
+
+    count: int = run_worker(drain)
+    print(f'{count} jobs run.')
 
 
-UpdateCommand: Command = Command('up', callback=check_for_updates_command)
+option: Option = Option(('--drain',), is_flag=True, help='Stop once the queue is empty.')
+params: List[Option] = [option]
+WorkerCommand: Command = Command('wk', callback=worker_command, params=params)
@@ -0,0 +1,142 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from flask import (
+    current_app,
+    request,
+    Response)
+from gzip import compress as compress_gzip
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union)
+from zlib import (
+    compressobj,
+    DEFLATED)
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is used without it
+    brotli = None
+
+
+BROTLI_QUALITY: int = 5  # brotli's default of 11 is meant for compressing ahead of time, and is far too slow for this
+COMPRESSIBLE_MIMETYPES: List[str] = ['application/json', 'application/msgpack']
+GZIP_LEVEL: int = 6
+GZIP_WBITS: int = 31  # zlib's deflate with a gzip header and trailer
+
+
+def choose_encoding() -> Optional[str]:
+    """Chooses the best content encoding the client accepts.
+
+    :return: The encoding, or None if the client doesn't accept any that are available.
+    """
+
+    encodings: List[str] = ['br', 'gzip'] if brotli is not None else ['gzip']
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+
+    return None
+
+
+def compress_body(data: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Compresses a whole body, if it's at least COMPRESSION_MIN_SIZE bytes, below which compression isn't worth it.
+
+    :param data: The body.
+    :param encoding: The content encoding to compress with, from choose_encoding.
+    :return: The body, and the encoding it was compressed with, None if it wasn't.
+    """
+
+    if encoding is None or len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return data, None
+
+    if encoding == 'br':
+        compressed: bytes = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed: bytes = compress_gzip(data, GZIP_LEVEL)
+    return compressed, encoding
+
+
+def compress_chunks(chunks: Iterable[Union[bytes, str]], encoding: str, charset: str) -> Iterator[bytes]:
+    """Compresses a streamed body as it's generated.
+
+    :param chunks: The chunks of the body.
+    :param encoding: The content encoding to compress with.
+    :param charset: The character set to encode text chunks with.
+    :return: An iterator of compressed chunks.
+    """
+
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = compressobj(GZIP_LEVEL, DEFLATED, GZIP_WBITS)
+        compress, finish = compressor.compress, compressor.flush
+
+    try:
+        for chunk in chunks:
+            data: bytes = chunk.encode(charset) if isinstance(chunk, str) else chunk
+            compressed: bytes = compress(data)
+            if compressed:
+                yield compressed
+
+        yield finish()
+    finally:
+        # pass the close on, so whatever is generating the body gets to clean up
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response: Response) -> Response:
+    """After-request handler that compresses API responses, with brotli if it's available and the client accepts it,
+    gzip otherwise.
+
+    Streamed responses are compressed as they're streamed. Others are only compressed if they're at least
+    COMPRESSION_MIN_SIZE bytes, below which compression isn't worth it.
+
+    :param response: The response.
+    :return: The response, compressed if it's worth it.
+    """
+
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    # the body differs depending on what the client accepts, so caches need to know
+    response.vary.add('Accept-Encoding')
+
+    encoding: Optional[str] = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding, response.charset)
+        response.headers.pop('Content-Length', None)
+    else:
+        data, applied = compress_body(response.get_data(), encoding)
+        if applied is None:
+            return response
+
+        response.set_data(data)
+
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,131 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import Counter
+from datetime import (
+    datetime,
+    timedelta)
+from json import dump
+from os import (
+    getpid,
+    replace)
+from pony.orm import (
+    db_session,
+    select)
+from signal import (
+    SIGINT,
+    signal,
+    SIGTERM)
+from threading import Event
+from typing import (
+    Callable,
+    Dict,
+    Optional)
+
+from database import Source as SourceModel
+from feeds import update_feeds
+
+
+MAX_SLEEP: timedelta = timedelta(minutes=1)  # so new sources, which are due straight away, aren't waited on for long
+MIN_SLEEP: timedelta = timedelta(seconds=1)
+
+
+def next_due() -> Optional[datetime]:
+    """Gets when the next source is due to be checked.
+
+    :return: The earliest next check of any source, None if there aren't any sources.
+    """
+
+    with db_session:
+        due: Optional[datetime] = select(s.next_check for s in SourceModel).min()
+
+    return due
+
+
+def run_daemon(status_path: str, workers: int, host_limit: int, batch_size: int,
+               after_update: Optional[Callable] = None) -> None:
+    """Keeps checking sources as they fall due, until it's sent SIGINT or SIGTERM.
+
+    Staying resident saves the start up costs of a process per update, and keeps the entries each source had when it
+    was last stored in memory, so unchanged feeds are stored without looking their entries up. Between updates it
+    sleeps until the next source is due.
+
+    Its state, and how far behind the schedule it is, is written to a JSON status file after each update, for health
+    checks.
+
+    :param status_path: Path of the status file, empty to not write one.
+    :param workers: Number of feeds to fetch at the same time.
+    :param host_limit: Maximum number of feeds to fetch at the same time from any one host.
+    :param batch_size: Number of sources to store per transaction.
+    :param after_update: Called after each update, for extra upkeep like pruning.
+    """
+
+    # finish storing what's been fetched, then stop
+    stop: Event = Event()
+    for signal_number in (SIGINT, SIGTERM):
+        signal(signal_number, lambda received, frame: stop.set())
+
+    seen: Dict[int, Dict[str, str]] = {}
+    status: dict = {'pid': getpid(), 'started': datetime.now().isoformat(), 'state': 'running', 'updates': 0}
+    while not stop.is_set():
+        # how late the most overdue source is being checked; new sources have never been scheduled, so don't count
+        started: datetime = datetime.now()
+        due: Optional[datetime] = next_due()
+        lag: timedelta = timedelta()
+        if due is not None and due > datetime.min:
+            lag = max(started - due, lag)
+
+        try:
+            stats: Counter = update_feeds(workers, host_limit, batch_size=batch_size, seen=seen, stop=stop)
+            if after_update is not None:
+                after_update()
+            status.update(error='', last_stats=dict(stats))
+        except Exception as error:
+            # a failed batch may leave what's remembered out of step with the database, so start afresh
+            seen.clear()
+            status['error'] = str(error) or type(error).__name__
+
+        finished: datetime = datetime.now()
+        due = next_due()
+        wake: datetime = finished + MAX_SLEEP
+        if due is not None:
+            wake = min(max(due, finished + MIN_SLEEP), wake)
+
+        status.update(lag_seconds=lag.total_seconds(), last_update_started=started.isoformat(),
+                      last_update_finished=finished.isoformat(), next_wake=wake.isoformat(),
+                      updates=status['updates'] + 1)
+        write_status(status_path, status)
+
+        stop.wait((wake - datetime.now()).total_seconds())
+
+    status['state'] = 'stopped'
+    write_status(status_path, status)
+
+
+def write_status(status_path: str, status: dict) -> None:
+    """Writes the daemon's status file, replacing the old one in one go, so readers never see half a file.
+
+    :param status_path: Path of the status file, empty to not write one.
+    :param status: The status.
+    """
+
+    if not status_path:
+        return
+
+    temporary_path: str = f'{status_path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as status_file:
+        dump(status, status_file, indent=2)
+
+    replace(temporary_path, status_path)
@@ -15,6 +15,7 @@
 
 from datetime import datetime
 from pony.orm import (
+    composite_index,
     composite_key,
     Database,
     Optional,
@@ -31,14 +32,56 @@ db = Database()
 
 
 class Entry(db.Entity):
-    """An individual entry in a feed."""
+    """An individual entry in a feed.
 
+    Entries are identified by the feed's id/guid for the entry, falling back to the link. The content hash covers
+    everything else stored, so a changed entry can be spotted and updated in place.
+    """
+
+    content_hash: Attribute = Required(str, 40, index=True)
+    excerpt: Attribute = Optional(str)  # short plain text version of the summary, for lists of entries
+    guid: Attribute = Required(str)
     link: Attribute = Required(str)
     source: Attribute = Required('Source')
     summary: Attribute = Optional(str)
+    timeline_items: Attribute = Set('TimelineItem')
     title: Attribute = Required(str)
-    updated: Attribute = Required(datetime)
-    composite_key(source, link, title, updated)
+    # SQLite indexes carry the row id, so this also serves the (updated, id) keyset pagination of the timeline, read
+    # as a range from the cursor's updated time
+    updated: Attribute = Required(datetime, index=True)
+    composite_key(source, guid)
+    composite_index(source, updated)  # entries of a set of sources, by date
+
+
+class Job(db.Entity):
+    """Background job, queued for a worker to run, with its progress for whoever queued it to check on."""
+
+    created: Attribute = Required(datetime)
+    done: Attribute = Required(int, default=0)  # steps done so far
+    error: Attribute = Optional(str)
+    finished: Attribute = Optional(datetime)
+    heartbeat: Attribute = Optional(datetime)  # when its worker last reported progress
+    kind: Attribute = Required(str)
+    payload: Attribute = Optional(str)  # JSON encoded arguments for the job's handler
+    started: Attribute = Optional(datetime)
+    status: Attribute = Required(str, default='pending', index=True)
+    total: Attribute = Required(int, default=0)  # steps to do, 0 until it's known
+    user: Attribute = Optional('User')  # None for jobs that aren't on anyone's behalf, like updates
+
+
+class Notice(db.Entity):
+    """Notice that an update stored new entries, published by the updater for the web workers to pass on."""
+
+    created: Attribute = Required(datetime, index=True)
+    latest_entry: Attribute = Required(int)
+
+
+class PrunedEntry(db.Entity):
+    """Entry deleted by pruning, remembered while it's still in its source's feed, so it isn't stored again."""
+
+    guid: Attribute = Required(str)
+    source: Attribute = Required('Source')
+    composite_key(source, guid)
 
 
 class Source(db.Entity):
@@ -46,11 +89,20 @@ class Source(db.Entity):
 
     feed_uri: Attribute = Required(str, unique=True)
     entries: Attribute = Set(Entry)
+    error_count: Attribute = Required(int, default=0)
+    etag: Attribute = Optional(str)
     fetched_label: Attribute = Required(str)
     last_check: Attribute = Required(datetime)
     last_fetch: Attribute = Required(datetime)
+    lease_owner: Attribute = Optional(str)  # the updater fetching the source, if one is
+    lease_until: Attribute = Optional(datetime)  # when the updater's claim on the source runs out
     link: Attribute = Required(str)
+    modified: Attribute = Optional(str)
+    next_check: Attribute = Required(datetime, default=datetime.min, index=True)
+    poll_interval: Attribute = Required(int, default=3600)  # seconds
+    pruned_entries: Attribute = Set(PrunedEntry)
     user_data: Attribute = Set('SourceUserData')
+    version: Attribute = Required(int, default=0)  # bumped whenever what the source shows in timelines changes
 
 
 class SourceUserData(db.Entity):
@@ -61,6 +113,7 @@ class SourceUserData(db.Entity):
     user: Attribute = Required('User')
     user_label: Attribute = Optional(str)
     composite_key(source, user)
+    composite_index(user, source)  # a user's subscriptions
 
     @property
     def label(self) -> str:
@@ -83,14 +136,27 @@ class Tag(db.Entity):
     composite_key(label, user)
 
 
+class TimelineItem(db.Entity):
+    """An entry in a user's materialized timeline. Only kept up to date while MATERIALIZED_TIMELINE is on."""
+
+    entry: Attribute = Required(Entry)
+    updated: Attribute = Required(datetime)  # copied from the entry, so the timeline can be read without a join
+    user: Attribute = Required('User')
+    composite_key(user, entry)
+    composite_index(user, updated)  # a user's timeline, by date
+
+
 class User(db.Entity):
     """User."""
 
     user_id: Attribute = PrimaryKey(UUID, default=uuid4)
+    jobs: Attribute = Set(Job)
     name: Attribute = Required(str, unique=True)
     password_hash: Attribute = Required(str)
     sources: Attribute = Set(SourceUserData)
     tags: Attribute = Set(Tag)
+    timeline: Attribute = Set(TimelineItem)
+    version: Attribute = Required(int, default=0)  # bumped whenever the user's subscriptions change
 
     @classmethod
     def build(cls, name: str, password: str) -> 'User':
@@ -8,10 +8,54 @@ DEBUG: bool = True
 
 SECRET_KEY: bytes = b'changeme'
 
+# Smallest API response body, in bytes, worth compressing. Streamed responses are always compressed.
+
+COMPRESSION_MIN_SIZE: int = 1024
+
+# Materialized timelines
+#
+# When on, stored entries are also written to a per-user timeline table, and /entries reads a page of it with a range
+# scan, rather than joining the entries against the user's subscriptions. Reads get cheaper at the cost of a row per
+# entry per subscriber. Run `flask rt` after switching it on, to fill the table from the entries stored so far.
+
+MATERIALIZED_TIMELINE: bool = False
+
+# Most bytes of encoded /entries pages to keep in memory, per process. 0 turns the cache off.
+
+TIMELINE_CACHE_SIZE: int = 16777216
+
 # Pony ORM database bindings
 
 PONY_BINDINGS: dict = {'provider': 'sqlite', 'filename': 'data/feeds.sqlite', 'create_db': True}
 
+# SQLite pragmas, applied to every connection
+#
+# Write-ahead logging lets the web app keep reading while an update is writing. busy_timeout is in milliseconds, a
+# negative cache_size is in KiB, and mmap_size is in bytes.
+
+SQLITE_PRAGMAS: dict = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'mmap_size': 268435456
+}
+
 # Generate Pony ORM bindings
 
 PONY_MAPPINGS: dict = {'create_tables': True}
+
+# Entry retention, applied by `flask pr`, or `flask up --prune`
+#
+# Entries last updated more than RETENTION_DAYS days ago are deleted, as are all but the newest RETENTION_PER_SOURCE
+# entries of each source. 0 turns a limit off. Deleted entries are appended to RETENTION_ARCHIVE, a gzip compressed
+# file of JSON lines, unless it's empty.
+
+RETENTION_DAYS: int = 0
+RETENTION_PER_SOURCE: int = 0
+RETENTION_ARCHIVE: str = ''
+
+# Status file written by `flask up --daemon` after each update, with its state and how far behind schedule it is. Empty
+# to not write one.
+
+UPDATER_STATUS_FILE: str = 'data/updater.json'
@@ -0,0 +1,121 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from html.parser import HTMLParser
+from typing import (
+    List,
+    Optional)
+
+
+# elements whose text shouldn't run into the text around them
+BLOCK_TAGS: List[str] = ['address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption',
+                         'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre',
+                         'section', 'table', 'td', 'th', 'tr', 'ul']
+
+EXCERPT_LENGTH: int = 280
+
+# elements whose content isn't readable text
+SKIPPED_TAGS: List[str] = ['script', 'style', 'template']
+
+
+class TextExtractor(HTMLParser):
+    """HTML parser that keeps only the readable text of a document."""
+
+    def __init__(self):
+        """Constructor."""
+
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skipping: int = 0
+
+    def handle_data(self, data: str) -> None:
+        """Keeps text, unless it's inside a skipped element.
+
+        :param data: The text.
+        """
+
+        if not self.skipping:
+            self.parts.append(data)
+
+    def handle_endtag(self, tag: str) -> None:
+        """Notes the end of a skipped element, and separates the text of block elements.
+
+        :param tag: The element name.
+        """
+
+        if tag in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+
+        if tag in BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        """Notes the start of a skipped element, and separates the text of block elements.
+
+        :param tag: The element name.
+        :param attrs: The element's attributes. Unused.
+        """
+
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+
+        if tag in BLOCK_TAGS:
+            self.parts.append(' ')
+
+    @property
+    def text(self) -> str:
+        """Gets the text kept so far, with runs of whitespace collapsed.
+
+        :return: The text.
+        """
+
+        return ' '.join(''.join(self.parts).split())
+
+
+def make_excerpt(summary: str, length: int = EXCERPT_LENGTH) -> str:
+    """Makes a short plain text excerpt of an entry's HTML summary.
+
+    :param summary: The entry's summary, which may be HTML.
+    :param length: The maximum length of the excerpt.
+    :return: The excerpt, cut at a word boundary and ending with an ellipsis if it was shortened.
+    """
+
+    text: str = plain_text(summary)
+    if len(text) <= length:
+        return text
+
+    # cut at the last space that leaves room for the ellipsis, or mid-word if there's one long word
+    cut: int = text.rfind(' ', 0, length)
+    if cut <= 0:
+        cut = length - 1
+
+    excerpt: str = text[:cut].rstrip() + '…'
+    return excerpt
+
+
+def plain_text(summary: Optional[str]) -> str:
+    """Gets the readable text of an entry's HTML summary, for excerpts and the search index.
+
+    :param summary: The entry's summary, which may be HTML.
+    :return: The text, with runs of whitespace collapsed.
+    """
+
+    if not summary:
+        return ''
+
+    extractor: TextExtractor = TextExtractor()
+    extractor.feed(summary)
+    extractor.close()
+    return extractor.text
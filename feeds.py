@@ -14,20 +14,350 @@
 
 
 from calendar import timegm
+from collections import (
+    Counter,
+    deque)
+from concurrent.futures import (
+    Executor,
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait)
 from datetime import datetime
 from feedparser import (
+    ACCEPT_HEADER,
+    FeedParserDict,
     parse,
-    FeedParserDict)
+    USER_AGENT)
+from hashlib import sha1
+from io import BytesIO
 from pony.orm import (
     db_session,
+    delete,
     select)
-from time import struct_time
+from pony.orm.core import Query
+from socket import (
+    AF_INET,
+    fromfd,
+    SHUT_RDWR,
+    SOCK_STREAM)
+from threading import (
+    Event,
+    Lock,
+    Timer)
+from time import (
+    monotonic,
+    struct_time)
 from typing import (
+    Callable,
+    Deque,
+    Dict,
     List,
-    Optional)
+    Optional,
+    Set,
+    Tuple)
+from urllib.parse import urlparse
+from urllib3 import (
+    HTTPResponse,
+    PoolManager,
+    Retry,
+    Timeout)
+from urllib3.exceptions import HTTPError
+from urllib3.util import make_headers
+from uuid import UUID
+
+from database import db, Entry as EntryModel, PrunedEntry as PrunedEntryModel, Source as SourceModel,\
+    SourceUserData as SourceUserDataModel, Tag as TagModel, User as UserModel
+from excerpt import make_excerpt
+from jobs import (
+    handles,
+    report_progress)
+from leases import (
+    claim_sources,
+    new_lease_owner,
+    release_leases,
+    renew_leases,
+    RENEW_INTERVAL)
+from notify import publish_notice
+from schedule import (
+    schedule_failure,
+    schedule_not_modified,
+    schedule_success)
+from timeline import (
+    add_to_timelines,
+    backfill_timeline,
+    timeline_enabled,
+    update_timelines)
+
+
+CLAIM_FACTOR: int = 4  # sources leased at a time, per worker thread
+DEFAULT_BATCH_SIZE: int = 1
+DEFAULT_HOST_LIMIT: int = 2
+DEFAULT_WORKERS: int = 8
+
+# HTTP fetching; timeouts are in seconds, sizes in bytes
+CONNECT_TIMEOUT: float = 10.0
+DECODED_HEADERS: Tuple[str, ...] = ('content-encoding', 'content-length')  # describe the body before it's decoded
+FETCH_CHUNK_SIZE: int = 65536
+FETCH_DEADLINE: float = 60.0
+MAX_FEED_SIZE: int = 10485760
+MAX_REDIRECTS: int = 5
+POOL_HOSTS: int = 100  # hosts to keep connections open to
+READ_TIMEOUT: float = 30.0
+REQUEST_HEADERS: Dict[str, str] = {**make_headers(accept_encoding=True, user_agent=USER_AGENT), 'Accept': ACCEPT_HEADER}
+
+# the connection pool is thread-safe, so it's shared by every fetch; fetches beyond the connections kept per host get
+# a connection of their own, which is closed afterwards
+http: PoolManager = PoolManager(num_pools=POOL_HOSTS, maxsize=DEFAULT_HOST_LIMIT,
+                                retries=Retry(total=MAX_REDIRECTS, connect=0, read=0, redirect=MAX_REDIRECTS),
+                                timeout=Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT))
+
+
+class FetchQueue:
+    """Fetches feeds on a thread pool, no more than a few at a time from any one host.
+
+    A fetch beyond its host's limit waits in a queue of the host's own, and is only handed to the pool once one of the
+    host's earlier fetches finishes. The pool's threads are never tied up waiting on a busy host, so feeds from other
+    hosts don't queue behind it.
+    """
+
+    def __init__(self, executor: Executor, limit: int):
+        """Constructor.
+
+        :param executor: The thread pool to fetch on.
+        :param limit: Maximum number of simultaneous fetches per host.
+        """
+
+        self.executor = executor
+        self.limit = limit
+        self.lock = Lock()
+        self.running: Counter = Counter()  # fetches handed to the pool, per host
+        self.waiting: Dict[str, Deque[Tuple[Future, str, str, str]]] = {}
+
+    def active(self) -> int:
+        """Counts the fetches handed to the pool that haven't finished yet.
+
+        :return: The number of fetches.
+        """
+
+        with self.lock:
+            count: int = sum(self.running.values())
+
+        return count
+
+    def fetch(self, host: str, future: Future, uri: str, etag: str, modified: str) -> None:
+        """Downloads and parses a feed on one of the pool's threads, then hands its host's slot on. Doesn't touch the
+        database.
+
+        :param host: The feed's host.
+        :param future: The future to set the parsed feed on.
+        :param uri: The URI of the feed.
+        :param etag: The ETag from the previous fetch, empty if there wasn't one.
+        :param modified: The Last-Modified value from the previous fetch, empty if there wasn't one.
+        """
+
+        try:
+            future.set_result(download_feed(uri, etag, modified))
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            self.start(host, self.next_waiting(host))
+
+    def next_waiting(self, host: str) -> Optional[Tuple[Future, str, str, str]]:
+        """Takes the next fetch waiting on a host that's just finished one, giving it the finished fetch's slot.
+
+        :param host: The host.
+        :return: The fetch, or None if none are waiting, in which case the slot is freed.
+        """
+
+        with self.lock:
+            waiting: Optional[Deque[Tuple[Future, str, str, str]]] = self.waiting.get(host)
+            if waiting:
+                return waiting.popleft()
+
+            self.running[host] -= 1
+            return None
+
+    def start(self, host: str, waiting: Optional[Tuple[Future, str, str, str]]) -> None:
+        """Hands a fetch that has a slot on its host to the pool, passing the slot on if the fetch has been cancelled.
+
+        :param host: The fetch's host.
+        :param waiting: The fetch, None for none.
+        """
+
+        while waiting is not None:
+            future, uri, etag, modified = waiting
+            if future.set_running_or_notify_cancel():
+                try:
+                    self.executor.submit(self.fetch, host, future, uri, etag, modified)
+                    return
+                except RuntimeError as error:  # the pool's been shut down
+                    future.set_exception(error)
+
+            waiting = self.next_waiting(host)
+
+    def submit(self, uri: str, etag: str, modified: str) -> Future:
+        """Queues a feed to be downloaded and parsed, see download_feed.
+
+        :param uri: The URI of the feed.
+        :param etag: The ETag from the previous fetch, empty if there wasn't one.
+        :param modified: The Last-Modified value from the previous fetch, empty if there wasn't one.
+        :return: A future of the parsed feed. Cancelling it before the fetch has started drops the fetch.
+        """
+
+        host: str = urlparse(uri).netloc.lower()
+        waiting: Tuple[Future, str, str, str] = (Future(), uri, etag, modified)
+        with self.lock:
+            if self.running[host] >= self.limit:
+                self.waiting.setdefault(host, deque()).append(waiting)
+                return waiting[0]
+
+            self.running[host] += 1
+
+        self.start(host, waiting)
+        return waiting[0]
+
+
+@handles('add_feed')
+def add_feed_job(job_id: int, user_id: UUID, payload: dict) -> None:
+    """Job handler that subscribes a user to a feed. If the feed doesn't have a source yet, it's fetched, and its
+    entries stored, first, so the source is ready to read once the job's done.
+
+    :param job_id: The ID of the job.
+    :param user_id: The ID of the user adding the feed.
+    :param payload: The job's arguments, the "url" of the feed.
+    """
+
+    url: str = payload['url']
+    report_progress(job_id, 0, 1)
+
+    with db_session:
+        known: bool = SourceModel.exists(feed_uri=url)
+
+    # fetch outside of the database session, so it's not held open on the network
+    feed: Optional[FeedParserDict] = None
+    if not known:
+        feed = download_feed(url, '', '')
+
+    with db_session:
+        source: Optional[SourceModel] = SourceModel.get(feed_uri=url)
+        if source is None:
+            source = build_source(url, feed)
+            source.flush()
+            store_feed(source.id, feed, Counter())
+
+        subscribe(source, [], UserModel[user_id])
+
+    # let the user's browser know about the new entries
+    publish_notice()
+    report_progress(job_id, 1)
+
+
+def cut_off(response: HTTPResponse, expired: Event) -> None:
+    """Cuts a fetch off once it's run out of time, by shutting its connection down, so a read waiting on the connection
+    returns straight away.
+
+    :param response: The response being read.
+    :param expired: Set once the fetch has been cut off.
+    """
 
-from database import Entry as EntryModel, Source as SourceModel, SourceUserData as SourceUserDataModel,\
-    Tag as TagModel, User as UserModel
+    # the connection's handed over to the response once it's to be closed after the body, so it's reached through the
+    # response's descriptor; shutting down a duplicate of it shuts down the connection they share
+    expired.set()
+    try:
+        with fromfd(response.fileno(), AF_INET, SOCK_STREAM) as sock:
+            sock.shutdown(SHUT_RDWR)
+    except (OSError, ValueError):  # it's already closed
+        pass
+
+
+def download_feed(uri: str, etag: str, modified: str) -> FeedParserDict:
+    """Downloads a feed through the shared connection pool, then parses it.
+
+    Connections are kept alive and reused between fetches from the same host. Each fetch has connect and read timeouts,
+    an overall time limit, and a size limit on the decompressed body, so a hung or runaway server can't stall an
+    update. Anything that goes wrong comes back as a bozo feed, the same as a feed that doesn't parse.
+
+    :param uri: The URI of the feed.
+    :param etag: The ETag from the previous fetch, empty if there wasn't one.
+    :param modified: The Last-Modified value from the previous fetch, empty if there wasn't one.
+    :return: The parsed feed, with the HTTP status, or a bozo feed with the reason it failed.
+    """
+
+    headers: Dict[str, str] = {**REQUEST_HEADERS}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+
+    try:
+        response: HTTPResponse = http.request('GET', uri, headers=headers, preload_content=False)
+    except (HTTPError, ValueError) as error:
+        return FeedParserDict(bozo=1, bozo_exception=error, entries=[], feed={}, headers={})
+
+    try:
+        # feedparser looks headers up in lower case; the content location is what relative links are resolved against
+        response_headers: Dict[str, str] = {key.lower(): value for key, value in response.headers.items()}
+        response_headers.setdefault('content-location', uri)
+
+        # nothing to download if it's not modified
+        if response.status == 304:
+            return FeedParserDict(bozo=0, entries=[], feed={}, headers=response_headers, status=304)
+
+        if response.status >= 400:
+            error: HTTPError = HTTPError(f'HTTP {response.status} {response.reason}')
+            return FeedParserDict(bozo=1, bozo_exception=error, entries=[], feed={}, headers=response_headers,
+                                  status=response.status)
+
+        # the read timeout applies to each read on its own, so a server trickling the body out could hold a fetch for as
+        # long as it liked; the connection's shut down at the deadline instead, which ends a read that's waiting on it
+        chunks: List[bytes] = []
+        size: int = 0
+        expired: Event = Event()
+        timer: Timer = Timer(FETCH_DEADLINE, cut_off, (response, expired))
+        timer.daemon = True
+        timer.start()
+        try:
+            for chunk in response.stream(FETCH_CHUNK_SIZE, decode_content=True):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > MAX_FEED_SIZE:
+                    break
+        except (HTTPError, OSError):
+            if not expired.is_set():
+                raise
+        finally:
+            timer.cancel()
+
+        if expired.is_set():
+            error: HTTPError = HTTPError(f'Feed took longer than {FETCH_DEADLINE} seconds.')
+        elif size > MAX_FEED_SIZE:
+            error: HTTPError = HTTPError(f'Feed is larger than {MAX_FEED_SIZE} bytes.')
+        else:
+            error: Optional[HTTPError] = None
+
+        # the rest of the body is abandoned, so the connection can't be reused
+        if error is not None:
+            response.close()
+            return FeedParserDict(bozo=1, bozo_exception=error, entries=[], feed={}, headers=response_headers,
+                                  status=response.status)
+    except (HTTPError, OSError) as error:
+        return FeedParserDict(bozo=1, bozo_exception=error, entries=[], feed={}, headers={})
+    finally:
+        response.release_conn()
+
+    # the body's been decoded already, so feedparser mustn't be told it's compressed, or it would decode it again and
+    # fail; its length has changed along with it
+    for header in DECODED_HEADERS:
+        response_headers.pop(header, None)
+
+    # the body's already been downloaded, so feedparser only has to parse it; it's given as a stream, as feedparser
+    # would take bytes for a file name or URL to open if they happened to look like one
+    feed: FeedParserDict = parse(BytesIO(b''.join(chunks)), response_headers=response_headers)
+    feed['status'] = response.status
+    feed.setdefault('etag', response_headers.get('etag', ''))
+    feed.setdefault('modified', response_headers.get('last-modified', ''))
+    return feed
 
 
 def fetch_and_store_feed(url: str, tags: List[TagModel], user: UserModel) -> None:
@@ -39,13 +369,7 @@ def fetch_and_store_feed(url: str, tags: List[TagModel], user: UserModel) -> Non
     """
 
     source: SourceModel = get_or_build_source(url)
-
-    user_data: SourceUserDataModel = SourceUserDataModel.get(user=user, source=source)
-    if user_data is not None:
-        update_tags(user_data, tags)
-        return
-
-    SourceUserDataModel(source=source, tags=tags, user=user)
+    subscribe(source, tags, user)
 
 
 def get_or_build_source(url: str) -> SourceModel:
@@ -59,12 +383,23 @@ def get_or_build_source(url: str) -> SourceModel:
     if source is not None:
         return source
 
-    feed: dict = parse(url)
+    feed: dict = download_feed(url, '', '')
+    source: SourceModel = build_source(url, feed)
+    return source
+
+
+def build_source(url: str, feed: dict) -> SourceModel:
+    """Builds a source from the feed data and stores it.
+
+    :param url: URL of the feed.
+    :param feed: The parsed feed.
+    :return: The built source.
+    """
 
     # get feed info or defaults
     feed_info: dict = feed.get('feed', {})
-    label: str = feed_info.get('title', url)
-    link: str = feed_info.get('link', url)
+    label: str = feed_info.get('title') or url
+    link: str = feed_info.get('link') or url
 
     source: SourceModel = SourceModel(feed_uri=url, fetched_label=label, last_check=datetime.min,
                                       last_fetch=datetime.min, link=link)
@@ -87,13 +422,37 @@ def utc_timestamp_from_struct_time(parsed_time: struct_time) -> datetime:
     return utc_datetime
 
 
-def process_entries(entries: List[FeedParserDict], source: SourceModel) -> None:
-    """Iterate through entries (presumably from a feed), add the new ones to the database.
+def hash_entry(link: str, title: str, updated: datetime, summary: str) -> str:
+    """Hashes the stored content of an entry, so changes to it can be detected.
+
+    :param link: The entry's link.
+    :param title: The entry's title.
+    :param updated: The entry's updated time.
+    :param summary: The entry's summary.
+    :return: A 40 character hex digest.
+    """
+
+    content: str = '\0'.join((link, title, updated.isoformat(), summary))
+    digest: str = sha1(content.encode('utf-8')).hexdigest()
+    return digest
+
+
+def process_entries(entries: List[FeedParserDict], source: SourceModel,
+                    seen: Optional[Dict[int, Dict[str, str]]] = None) -> Dict[str, str]:
+    """Iterate through entries (presumably from a feed), add the new ones to the database, and update the ones that
+    have changed.
+
+    The entries already stored are looked up in a single query, rather than one per entry. If the entries are all as
+    they were when the source was last seen, even that query is skipped.
 
     :param entries: The entries from the feed.
     :param source: The source that the entries should be associated with.
+    :param seen: The content hashes of the entries each source had when it was last stored, keyed by source ID then
+        guid, None to always look the entries up.
+    :return: The content hashes of the entries, keyed by guid, to update seen with once they're committed.
     """
 
+    candidates: Dict[str, Tuple[str, str, str, datetime, str]] = {}
     for entry in entries:
         # build UTC time
         updated_parsed: struct_time = entry.get('updated_parsed', None)
@@ -103,41 +462,319 @@ def process_entries(entries: List[FeedParserDict], source: SourceModel) -> None:
         if not link:  # no point to an entry without a link
             continue
 
-        title: str = entry.get('title', link)
+        guid: str = entry.get('id') or link
+        title: str = entry.get('title') or link
         summary: str = entry.get('summary', '')
-
-        # check if this entry already exists
-        check: Optional[EntryModel] = EntryModel.get(link=link, source=source, title=title, updated=updated)
-        if check is not None:
+        content_hash: str = hash_entry(link, title, updated, summary)
+
+        # feeds can repeat an entry, the last one wins
+        candidates[guid] = (content_hash, link, title, updated, summary)
+
+    # nothing's new or changed if every entry was in the feed, as it is, last time
+    hashes: Dict[str, str] = {guid: candidate[0] for guid, candidate in candidates.items()}
+    if seen is not None:
+        last_seen: Dict[str, str] = seen.get(source.id, {})
+        if all(last_seen.get(guid) == content_hash for guid, content_hash in hashes.items()):
+            return hashes
+
+    if not candidates:
+        return hashes
+
+    # get the hashes of the entries we already have, in one go
+    guids: List[str] = list(candidates)
+    known: Dict[str, Tuple[str, int, datetime]] = {}
+    for guid, content_hash, entry_id, updated in select((e.guid, e.content_hash, e.id, e.updated) for e in EntryModel
+                                                        if e.source == source and e.guid in guids):
+        known[guid] = (content_hash, entry_id, updated)
+
+    # entries stored before guids were have their link for a guid; they take on the feed's guid when it's first seen
+    unmatched: Dict[str, str] = {}
+    for guid, (_, link, _, _, _) in candidates.items():
+        if guid not in known and guid != link:
+            unmatched.setdefault(link, guid)
+
+    if unmatched:
+        links: List[str] = list(unmatched)
+        legacy: Query = select((e.id, e.link, e.content_hash, e.updated) for e in EntryModel
+                               if e.source == source and e.link in links and e.guid == e.link)
+        for entry_id, link, content_hash, updated in legacy:
+            EntryModel[entry_id].guid = unmatched[link]
+            known[unmatched[link]] = (content_hash, entry_id, updated)
+
+    # pruned entries stay pruned while they're still in the feed; once they've dropped out, they needn't be remembered
+    pruned: Set[str] = set(select(p.guid for p in PrunedEntryModel if p.source == source))
+    if pruned - candidates.keys():
+        delete(p for p in PrunedEntryModel if p.source == source and p.guid not in guids)
+
+    # entries without a date are dated when they're first stored, so they have a place in timelines and age like others
+    first_stored: datetime = datetime.utcnow()
+
+    materialized: bool = timeline_enabled()
+    added: List[EntryModel] = []
+    changed: bool = False
+    for guid, (content_hash, link, title, updated, summary) in candidates.items():
+        if guid in pruned:
             continue
 
         # unique entry, add it
-        EntryModel(link=link, source=source, summary=summary, title=title, updated=updated)
+        stored: Optional[Tuple[str, int, datetime]] = known.get(guid)
+        if stored is None:
+            added.append(EntryModel(content_hash=content_hash, excerpt=make_excerpt(summary), guid=guid, link=link,
+                                    source=source, summary=summary, title=title,
+                                    updated=updated if updated > datetime.min else first_stored))
+            continue
 
+        # changed entry, update it in place, keeping the date it was first stored with if it hasn't got one
+        stored_hash, entry_id, stored_updated = stored
+        if stored_hash != content_hash:
+            updated = updated if updated > datetime.min else stored_updated
+            EntryModel[entry_id].set(content_hash=content_hash, excerpt=make_excerpt(summary), link=link,
+                                     summary=summary, title=title, updated=updated)
+            if materialized:
+                update_timelines(entry_id, updated)
+            changed = True
 
-def update_feeds() -> None:
-    """Checks all sources for feed updates."""
+    if added and materialized:
+        add_to_timelines(added, source)
 
-    with db_session:
-        sources = select(s for s in SourceModel)
-        for source in sources:
-            now: datetime = datetime.now()
+    # invalidate cached timelines that include this source
+    if added or changed:
+        source.version += 1
+
+    return hashes
+
+
+def store_feed(source_id: int, feed: FeedParserDict, stats: Counter,
+               seen: Optional[Dict[int, Dict[str, str]]] = None) -> Optional[Dict[str, str]]:
+    """Stores the result of fetching a source's feed, and schedules the source's next check. Must be called within a
+    database session.
+
+    :param source_id: The ID of the source that was fetched.
+    :param feed: The parsed feed.
+    :param stats: Counts of the feeds that were fetched, not modified, and failed, to add this result to.
+    :param seen: The content hashes of the entries each source had when it was last stored, see process_entries.
+    :return: The content hashes of the feed's entries, keyed by guid, or None if the feed's entries weren't processed.
+    """
+
+    source: SourceModel = SourceModel[source_id]
+    source.last_check = datetime.now()
+
+    # done with it, whatever the result
+    source.lease_owner = ''
+    source.lease_until = None
+
+    # check if download was successful
+    if feed['bozo']:
+        schedule_failure(source, source.last_check)
+        stats['failed'] += 1
+        return None
+
+    # nothing to do if the feed hasn't changed since the last fetch
+    if feed.get('status') == 304:
+        schedule_not_modified(source, source.last_check)
+        stats['not_modified'] += 1
+        return None
+
+    schedule_success(source, feed, source.last_check)
+    stats['fetched'] += 1
+
+    # update with new data, if we have any; use the old data otherwise
+    label: str = source.fetched_label
+    source.fetched_label = feed.get('feed', {}).get('title') or label
+    source.last_fetch = source.last_check
 
-            # fetch & parse feed
-            feed: dict = parse(source.feed_uri)
-            source.last_check = now
+    # the label is shown in timelines, so invalidate the cached ones if it's changed
+    if source.fetched_label != label:
+        source.version += 1
 
-            # check if download was successful
-            if feed['bozo']:
+    # remember the validators for the next fetch
+    source.etag = feed.get('etag', '')
+    source.modified = feed.get('modified', '')
+
+    # check for and process new entries
+    hashes: Dict[str, str] = process_entries(feed['entries'], source, seen)
+    return hashes
+
+
+def store_batch(results: List[Tuple[int, FeedParserDict]], stats: Counter,
+                seen: Optional[Dict[int, Dict[str, str]]] = None) -> bool:
+    """Stores a batch of fetch results in a transaction of its own.
+
+    :param results: The IDs of the sources that were fetched, with their parsed feeds.
+    :param stats: Counts of the feeds that were fetched, not modified, and failed, to add these results to.
+    :param seen: The content hashes of the entries each source had when it was last stored, see process_entries. It's
+        updated once the batch is committed, so a failed batch doesn't leave it claiming entries that weren't stored.
+    :return: Whether the batch was stored; if it wasn't, nothing was, and neither stats nor seen have changed.
+    """
+
+    # counted as they're stored, but only kept once they're committed
+    counts: Counter = Counter()
+    stored: Dict[int, Dict[str, str]] = {}
+    try:
+        with db_session:
+            for source_id, feed in results:
+                hashes: Optional[Dict[str, str]] = store_feed(source_id, feed, counts, seen)
+                if hashes is not None:
+                    stored[source_id] = hashes
+    except Exception:
+        return False
+
+    stats.update(counts)
+    if seen is not None:
+        seen.update(stored)
+
+    return True
+
+
+def store_feeds(results: List[Tuple[int, FeedParserDict]], stats: Counter,
+                seen: Optional[Dict[int, Dict[str, str]]] = None) -> None:
+    """Stores a batch of fetch results in a transaction of its own, then lets the web workers know about any new
+    entries.
+
+    Keeping the transactions short means the session's cache doesn't grow over a whole update, readers aren't held up
+    behind a long write, and a failure only loses the batch it happened in. A batch that fails is stored again a feed at
+    a time, and a feed that still can't be stored is scheduled as a failed fetch, so it neither stops the update nor is
+    retried straight away.
+
+    :param results: The IDs of the sources that were fetched, with their parsed feeds.
+    :param stats: Counts of the feeds that were fetched, not modified, and failed, to add these results to.
+    :param seen: The content hashes of the entries each source had when it was last stored, see process_entries.
+    """
+
+    # a feed in the batch couldn't be stored, so the others are stored one at a time to find it
+    if not store_batch(results, stats, seen):
+        for source_id, feed in results:
+            if len(results) > 1 and store_batch([(source_id, feed)], stats, seen):
                 continue
 
-            # update with new data, if we have any; use the old data otherwise
-            label: str = source.fetched_label
-            source.fetched_label = feed.get('feed', {}).get('title', label)
-            source.last_fetch = now
+            # the source itself may not be writable, in which case its lease runs out on its own
+            failed: FeedParserDict = FeedParserDict(bozo=1, entries=[], feed={}, headers={})
+            if not store_batch([(source_id, failed)], stats):
+                stats['failed'] += 1
+
+    publish_notice()
+
 
-            # check for and process new entries
-            process_entries(feed['entries'], source)
+def subscribe(source: SourceModel, tags: List[TagModel], user: UserModel) -> None:
+    """Subscribes a user to a source, or adds any new tags if they're already subscribed.
+
+    :param source: The source to subscribe to.
+    :param tags: Tags to add to the source.
+    :param user: User subscribing.
+    """
+
+    user_data: SourceUserDataModel = SourceUserDataModel.get(user=user, source=source)
+    if user_data is not None:
+        update_tags(user_data, tags)
+        return
+
+    SourceUserDataModel(source=source, tags=tags, user=user)
+    if timeline_enabled():
+        backfill_timeline(user, source)
+
+    # invalidate the user's cached timelines
+    user.version += 1
+
+
+def update_feeds(workers: int = DEFAULT_WORKERS, host_limit: int = DEFAULT_HOST_LIMIT, everything: bool = False,
+                 batch_size: int = DEFAULT_BATCH_SIZE, seen: Optional[Dict[int, Dict[str, str]]] = None,
+                 stop: Optional[Event] = None, progress: Optional[Callable[[int], None]] = None) -> Counter:
+    """Checks sources that are due for feed updates, then schedules their next check.
+
+    Feeds are downloaded and parsed concurrently by a pool of worker threads, while the results are written to the
+    database from the calling thread only, so there's a single writer. Results are committed in small batches as they
+    arrive.
+
+    Sources are leased a batch at a time as they're needed, so several updaters can share the sources between them,
+    even from different hosts, without fetching any twice. The leases are renewed while the update runs, so sources
+    queued behind a slow host aren't claimed by another updater in the meantime.
+
+    :param workers: Number of feeds to fetch at the same time.
+    :param host_limit: Maximum number of feeds to fetch at the same time from any one host.
+    :param everything: Check every source, even the ones that aren't due yet.
+    :param batch_size: Number of sources to store per transaction.
+    :param seen: The content hashes of the entries each source had when it was last stored, see process_entries. A
+        long-running updater keeps this between updates.
+    :param stop: Stop early once this is set, storing what's been fetched so far. Sources that weren't fetched are left
+        due.
+    :param progress: Called with the number of sources checked so far each time the leases are renewed, for a job to
+        report how far it's got, None to not report.
+    :return: Counts of the feeds that were fetched, not modified, and failed.
+    """
+
+    started: datetime = datetime.now()
+    owner: str = new_lease_owner()
+    claim_size: int = workers * CLAIM_FACTOR
+    stats: Counter = Counter(fetched=0, not_modified=0, failed=0)
+    renew_seconds: float = RENEW_INTERVAL.total_seconds()
+    renew_at: float = monotonic() + renew_seconds
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetches: FetchQueue = FetchQueue(executor, host_limit)
+            futures: Dict[Future, int] = {}
+            batch: List[Tuple[int, FeedParserDict]] = []
+            exhausted: bool = False
+            while True:
+                # keep the workers busy, claiming more sources while some are idle; when the sources claimed so far are
+                # mostly from a few busy hosts, a claim's worth can be waiting on them
+                if not exhausted and fetches.active() < workers and len(futures) - fetches.active() < claim_size:
+                    claimed: List[Tuple[int, str, str, str]] = claim_sources(db, owner, claim_size, started, everything)
+                    exhausted = not claimed
+                    futures.update({fetches.submit(uri, etag, modified): source_id
+                                    for source_id, uri, etag, modified in claimed})
+
+                if not futures:
+                    break
+
+                # keep hold of the sources still waiting their turn, however long they wait
+                done: Set[Future] = wait(futures, timeout=renew_seconds, return_when=FIRST_COMPLETED).done
+                if monotonic() >= renew_at:
+                    renew_leases(db, owner)
+                    renew_at = monotonic() + renew_seconds
+                    if progress is not None:
+                        progress(sum(stats.values()))
+
+                # write the results as they arrive; dropping the futures as we go lets the parsed feeds be freed
+                for future in done:
+                    source_id: int = futures.pop(future)
+                    try:
+                        feed: FeedParserDict = future.result()
+                    except Exception as error:
+                        feed = FeedParserDict(bozo=1, bozo_exception=error, entries=[], feed={}, headers={})
+
+                    batch.append((source_id, feed))
+                    if len(batch) >= batch_size:
+                        store_feeds(batch, stats, seen)
+                        batch = []
+
+                # drop the fetches that haven't started; the ones already running are waited for, but not stored
+                if stop is not None and stop.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+            if batch:
+                store_feeds(batch, stats, seen)
+    finally:
+        # anything claimed but not stored can go to another updater now, rather than when the lease runs out
+        release_leases(db, owner)
+
+    return stats
+
+
+@handles('update')
+def update_job(job_id: int, user_id: Optional[UUID], payload: dict) -> None:
+    """Job handler that checks sources for feed updates, like update_feeds.
+
+    :param job_id: The ID of the job.
+    :param user_id: Unused, updates aren't for any one user.
+    :param payload: The job's arguments, any of update_feeds' arguments.
+    """
+
+    # the update reports as it goes, so a long one isn't taken for one whose worker died
+    stats: Counter = update_feeds(**payload, progress=lambda checked: report_progress(job_id, checked))
+    checked: int = sum(stats.values())
+    report_progress(job_id, checked, checked)
 
 
 def update_tags(user_data: SourceUserDataModel, tags: List[TagModel]) -> None:
@@ -153,3 +790,6 @@ def update_tags(user_data: SourceUserDataModel, tags: List[TagModel]) -> None:
             continue
 
         user_data.tags.add(tag)
+
+        # tags are shown in the user's timelines, so invalidate the cached ones
+        user_data.user.version += 1
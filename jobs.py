@@ -0,0 +1,188 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import (
+    datetime,
+    timedelta)
+from json import (
+    dumps,
+    loads)
+from pony.orm import (
+    db_session,
+    OptimisticCheckError,
+    select)
+from pony.orm.core import Query
+from time import sleep
+from typing import (
+    Callable,
+    Dict,
+    Optional,
+    Tuple)
+from uuid import UUID
+
+from database import (
+    Job as JobModel,
+    User as UserModel)
+
+
+JOB_DONE: str = 'done'
+JOB_FAILED: str = 'failed'
+JOB_PENDING: str = 'pending'
+JOB_RUNNING: str = 'running'
+JOB_TIMEOUT: timedelta = timedelta(minutes=10)  # longer than a job goes between reports; one quieter lost its worker
+POLL_SECONDS: float = 1.0
+
+# job handlers, keyed by the kind of job they run, registered with handles
+handlers: Dict[str, Callable[[int, Optional[UUID], dict], None]] = {}
+
+
+def claim_job() -> Optional[Tuple[int, str, Optional[UUID], dict]]:
+    """Claims the oldest pending job, marking it as running.
+
+    Claims are safe between workers. If another worker claims the same job first, the claim fails its optimistic check
+    when it's committed, and the next pending job is tried instead.
+
+    Running jobs that haven't reported progress for longer than JOB_TIMEOUT are taken to have been left behind by a
+    worker that died, and are put back in the queue first. However long a job runs, it isn't taken from a worker that's
+    still reporting on it.
+
+    :return: The ID, kind, user ID and payload of the claimed job, or None if there aren't any pending jobs.
+    """
+
+    while True:
+        try:
+            with db_session:
+                # jobs claimed before there were heartbeats only have when they started to go on
+                cutoff: datetime = datetime.now() - JOB_TIMEOUT
+                for stale in select(j for j in JobModel if j.status == JOB_RUNNING and (
+                        j.heartbeat < cutoff or j.heartbeat is None and j.started < cutoff)):
+                    stale.set(heartbeat=None, started=None, status=JOB_PENDING)
+
+                pending: Query = select(j for j in JobModel if j.status == JOB_PENDING).order_by(JobModel.id)
+                job: Optional[JobModel] = pending.first()
+                if job is None:
+                    return None
+
+                now: datetime = datetime.now()
+                job.set(heartbeat=now, started=now, status=JOB_RUNNING)
+                user_id: Optional[UUID] = job.user.user_id if job.user is not None else None
+                return job.id, job.kind, user_id, loads(job.payload or '{}')
+        except OptimisticCheckError:
+            continue
+
+
+def enqueue_job(kind: str, payload: dict, user_id: Optional[UUID] = None) -> int:
+    """Queues a job for a worker to run.
+
+    :param kind: What sort of job it is, one of the kinds in handlers.
+    :param payload: The JSON-serializable arguments for the job's handler.
+    :param user_id: The ID of the user the job is for, None if it isn't for anyone.
+    :return: The ID of the job.
+    """
+
+    with db_session:
+        user: Optional[UserModel] = UserModel[user_id] if user_id is not None else None
+        job: JobModel = JobModel(created=datetime.now(), kind=kind, payload=dumps(payload), user=user)
+        job.flush()
+        return job.id
+
+
+def finish_job(job_id: int, error: str = '') -> None:
+    """Marks a job as finished.
+
+    :param job_id: The ID of the job.
+    :param error: What went wrong, empty if the job succeeded.
+    """
+
+    with db_session:
+        job: JobModel = JobModel[job_id]
+        job.set(error=error, finished=datetime.now(), status=JOB_FAILED if error else JOB_DONE)
+
+
+def handles(kind: str) -> Callable:
+    """Decorator that registers a function as the handler of a kind of job. Handlers are called with the job's ID, the
+    ID of the user it's for, and its payload.
+
+    :param kind: The kind of job the function runs.
+    :return: The decorator.
+    """
+
+    def register(handler: Callable[[int, Optional[UUID], dict], None]) -> Callable[[int, Optional[UUID], dict], None]:
+        handlers[kind] = handler
+        return handler
+
+    return register
+
+
+def report_progress(job_id: int, done: int, total: Optional[int] = None) -> None:
+    """Records how far a job has got, which also shows its worker's still running it. Handlers of long jobs report more
+    often than JOB_TIMEOUT, even when they haven't got any further, or the job's queued again for another worker.
+
+    :param job_id: The ID of the job.
+    :param done: The number of steps done so far.
+    :param total: The number of steps to do, None to leave it as it is.
+    """
+
+    with db_session:
+        job: JobModel = JobModel[job_id]
+        job.set(done=done, heartbeat=datetime.now())
+        if total is not None:
+            job.total = total
+
+
+def run_job(job_id: int, kind: str, user_id: Optional[UUID], payload: dict) -> None:
+    """Runs a claimed job with its handler, recording how it ended on the job.
+
+    :param job_id: The ID of the job.
+    :param kind: What sort of job it is.
+    :param user_id: The ID of the user the job is for, None if it isn't for anyone.
+    :param payload: The arguments for the job's handler.
+    """
+
+    handler: Optional[Callable[[int, Optional[UUID], dict], None]] = handlers.get(kind)
+    if handler is None:
+        finish_job(job_id, f'Unknown kind of job "{kind}".')
+        return
+
+    # there's no one to pass a failure on to, so it's recorded on the job for whoever queued it to see
+    try:
+        handler(job_id, user_id, payload)
+    except Exception as error:
+        finish_job(job_id, str(error) or type(error).__name__)
+        return
+
+    finish_job(job_id)
+
+
+def run_worker(drain: bool = False, poll_seconds: float = POLL_SECONDS) -> int:
+    """Runs queued jobs, one at a time, oldest first. Any number of workers can share a queue.
+
+    :param drain: Stop once the queue is empty, rather than waiting for more jobs.
+    :param poll_seconds: How long to wait between checks of an empty queue.
+    :return: The number of jobs run.
+    """
+
+    count: int = 0
+    while True:
+        claimed: Optional[Tuple[int, str, Optional[UUID], dict]] = claim_job()
+        if claimed is None:
+            if drain:
+                return count
+
+            sleep(poll_seconds)
+            continue
+
+        run_job(*claimed)
+        count += 1
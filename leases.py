@@ -0,0 +1,111 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import (
+    datetime,
+    timedelta)
+from os import getpid
+from pony.orm import (
+    Database,
+    db_session)
+from socket import gethostname
+from typing import (
+    List,
+    Tuple)
+from uuid import uuid4
+
+
+# Sources are leased to an updater while it fetches them, so any number of updaters, on any number of hosts, can share a
+# database without fetching a source twice. A lease runs out on its own, so the sources of an updater that dies are
+# picked up again by the others. Claimed sources can wait a long while for their turn behind others on the same host, so
+# an updater renews its leases every RENEW_INTERVAL for as long as it's running.
+LEASE_DURATION: timedelta = timedelta(minutes=10)
+RENEW_INTERVAL: timedelta = LEASE_DURATION / 4
+
+# the way Pony stores date-times, so they compare as strings in raw SQL
+DATETIME_FORMAT: str = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def claim_sources(db: Database, owner: str, limit: int, started: datetime, everything: bool = False,
+                  duration: timedelta = LEASE_DURATION) -> List[Tuple[int, str, str, str]]:
+    """Leases a batch of sources that are due, and that no other updater holds a lease on, most overdue first.
+
+    The sources are picked and leased by a single UPDATE, so two updaters can't claim the same source. Sources checked
+    since the update started aren't claimed again.
+
+    :param db: The bound database.
+    :param owner: The claiming updater's lease owner name, from new_lease_owner.
+    :param limit: The most sources to claim.
+    :param started: When the claiming update started.
+    :param everything: Claim sources even if they aren't due yet.
+    :param duration: How long the lease lasts.
+    :return: The ID, feed URI, ETag and Last-Modified value of each claimed source.
+    """
+
+    now: datetime = datetime.now()
+    now_text: str = now.strftime(DATETIME_FORMAT)
+    until: str = (now + duration).strftime(DATETIME_FORMAT)
+    started_text: str = started.strftime(DATETIME_FORMAT)
+    due: str = (datetime.max if everything else started).strftime(DATETIME_FORMAT)
+
+    with db_session:
+        db.execute('''
+            UPDATE "Source" SET "lease_owner" = $owner, "lease_until" = $until
+            WHERE "id" IN (
+                SELECT "id" FROM "Source"
+                WHERE "next_check" <= $due AND "last_check" < $started_text
+                    AND ("lease_until" IS NULL OR "lease_until" < $now_text)
+                ORDER BY "next_check"
+                LIMIT $limit)''')
+
+        # the lease's expiry tells this claim's sources apart from the owner's earlier claims
+        sources: List[Tuple[int, str, str, str]] = db.select('''SELECT "id", "feed_uri", "etag", "modified"
+            FROM "Source" WHERE "lease_owner" = $owner AND "lease_until" = $until''')
+
+    return sources
+
+
+def new_lease_owner() -> str:
+    """Makes up a lease owner name for an updater, unique to it, but recognisable for anyone looking at the database.
+
+    :return: The owner name, of the host, process ID and a random suffix.
+    """
+
+    owner: str = f'{gethostname()}:{getpid()}:{uuid4().hex[:8]}'
+    return owner
+
+
+def renew_leases(db: Database, owner: str, duration: timedelta = LEASE_DURATION) -> None:
+    """Extends an updater's leases on the sources it's claimed but not stored yet.
+
+    :param db: The bound database.
+    :param owner: The updater's lease owner name.
+    :param duration: How long the leases last from now.
+    """
+
+    until: str = (datetime.now() + duration).strftime(DATETIME_FORMAT)
+    with db_session:
+        db.execute('UPDATE "Source" SET "lease_until" = $until WHERE "lease_owner" = $owner')
+
+
+def release_leases(db: Database, owner: str) -> None:
+    """Gives up an updater's leases on the sources it didn't get to, so other updaters can claim them straight away.
+
+    :param db: The bound database.
+    :param owner: The updater's lease owner name.
+    """
+
+    with db_session:
+        db.execute('UPDATE "Source" SET "lease_owner" = \'\', "lease_until" = NULL WHERE "lease_owner" = $owner')
@@ -17,44 +17,86 @@ from flask import Flask
 from flask_restful import Api
 from pony.orm import set_sql_debug
 
+from cache import timeline_cache
 from cli import (
     AddUserCommand,
-    UpdateCommand)
+    MaintainCommand,
+    MigrateCommand,
+    PruneCommand,
+    RebuildSearchCommand,
+    RebuildTimelinesCommand,
+    UpdateCommand,
+    WorkerCommand)
+from compression import compress_response
 from database import db
 from login import login_manager
+from representations import (
+    msgpack,
+    output_json,
+    output_msgpack)
 from rest import (
     Entries as EntryResource,
+    EntryDetail as EntryDetailResource,
+    EntrySearch as EntrySearchResource,
+    JobStatus as JobStatusResource,
     Sources as SourceResource,
     Tags as TagResource)
 from routes import (
     add_feed as add_feed_route,
+    entries_stream as entries_stream_route,
     login as login_route,
     logout as logout_route,
     root as root_route,
     upload_opml as upload_opml_route)
+from search import setup_search
+from storage import (
+    configure_storage,
+    migrate_storage)
 
 
 # application
 
 app: Flask = Flask(__name__)
+app.config.from_object('defaultconfig')
 app.config.from_pyfile('data/config.py')
 
 
 # database
 
+configure_storage(db, app.config['SQLITE_PRAGMAS'])
 db.bind(**app.config['PONY_BINDINGS'])
 set_sql_debug(app.config['DEBUG'])
-db.generate_mapping(**app.config['PONY_MAPPINGS'])
+# a database from an older version is brought up to date before Pony creates any tables or indexes it's missing
+migrate_storage(db, app.config['SQLITE_PRAGMAS'])
+mappings: dict = {'check_tables': False, **app.config['PONY_MAPPINGS']}
+db.generate_mapping(**mappings)
+setup_search(db)
 
 
 # REST API
 
 api: Api = Api(app)
+api.representations['application/json'] = output_json
+if msgpack is not None:
+    api.representations['application/msgpack'] = output_msgpack
 api.add_resource(EntryResource, '/entries')
+api.add_resource(EntryDetailResource, '/entries/<int:entry_id>')
+api.add_resource(EntrySearchResource, '/entries/search')
+api.add_resource(JobStatusResource, '/jobs/<int:job_id>')
 api.add_resource(SourceResource, '/sources')
 api.add_resource(TagResource, '/tags')
 
 
+# response compression
+
+app.after_request(compress_response)
+
+
+# timeline cache
+
+timeline_cache.init_app(app)
+
+
 # login management
 
 login_manager.init_app(app)
@@ -63,13 +105,20 @@ login_manager.init_app(app)
 # cli
 
 app.cli.add_command(AddUserCommand)
+app.cli.add_command(MaintainCommand)
+app.cli.add_command(MigrateCommand)
+app.cli.add_command(PruneCommand)
+app.cli.add_command(RebuildSearchCommand)
+app.cli.add_command(RebuildTimelinesCommand)
 app.cli.add_command(UpdateCommand)
+app.cli.add_command(WorkerCommand)
 
 
 # routes
 
 app.add_url_rule('/', view_func=root_route)
 app.add_url_rule('/add_form', view_func=add_feed_route, methods=['POST'])
+app.add_url_rule('/entries/stream', view_func=entries_stream_route)
 app.add_url_rule('/login', view_func=login_route, methods=['POST'])
 app.add_url_rule('/logout', view_func=logout_route)
 app.add_url_rule('/upload_opml', view_func=upload_opml_route, methods=['POST'])
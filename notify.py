@@ -0,0 +1,92 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import (
+    datetime,
+    timedelta)
+from pony.orm import (
+    db_session,
+    delete,
+    select)
+from time import sleep
+from typing import (
+    Iterator,
+    Optional)
+
+from database import (
+    Entry as EntryModel,
+    Notice as NoticeModel)
+
+
+KEEPALIVE_SECONDS: float = 15.0
+NOTICE_RETENTION: timedelta = timedelta(days=1)
+POLL_SECONDS: float = 2.0
+
+
+def latest_notice() -> int:
+    """Gets the latest entry ID that's been published in a notice.
+
+    :return: The entry ID, 0 if nothing has been published.
+    """
+
+    with db_session:
+        latest: Optional[int] = select(n.latest_entry for n in NoticeModel).max()
+
+    return latest or 0
+
+
+def publish_notice() -> None:
+    """Publishes a notice that new entries have been stored, if any have been since the last notice. Must be called
+    after the new entries have been committed."""
+
+    with db_session:
+        latest_entry: Optional[int] = select(e.id for e in EntryModel).max()
+        last_notice: Optional[int] = select(n.latest_entry for n in NoticeModel).max()
+        if not latest_entry or (last_notice is not None and last_notice >= latest_entry):
+            return
+
+        now: datetime = datetime.now()
+        NoticeModel(created=now, latest_entry=latest_entry)
+
+        # listeners only ever want the latest notice, so old ones can go
+        cutoff: datetime = now - NOTICE_RETENTION
+        delete(n for n in NoticeModel if n.created < cutoff)
+
+
+def wait_for_notices(after_entry: int) -> Iterator[Optional[int]]:
+    """Waits for notices of entries newer than the given one.
+
+    Yields the latest entry ID of each new notice as it's published. Yields None if nothing has been published for a
+    while, so the caller gets a chance to send a keep-alive. Never finishes on its own.
+
+    :param after_entry: Only notices of entries newer than this one are yielded.
+    :return: An iterator of entry IDs.
+    """
+
+    waited: float = 0.0
+    while True:
+        latest: int = latest_notice()
+        if latest > after_entry:
+            after_entry = latest
+            waited = 0.0
+            yield latest
+            continue
+
+        if waited >= KEEPALIVE_SECONDS:
+            waited = 0.0
+            yield None
+
+        sleep(POLL_SECONDS)
+        waited += POLL_SECONDS
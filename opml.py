@@ -13,77 +13,195 @@
 # limitations under the License.
 
 
-from pony.orm import db_session
-from typing import Optional
+from collections import Counter
+from concurrent.futures import (
+    as_completed,
+    Future,
+    ThreadPoolExecutor)
+from feedparser import FeedParserDict
+from pony.orm import (
+    db_session,
+    select)
+from typing import (
+    BinaryIO,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set)
 from uuid import UUID
-from xml.etree.ElementTree import (
-    Element,
-    ElementTree,
-    parse)
+from xml.etree.ElementTree import iterparse
 
 from database import (
+    Source as SourceModel,
     Tag as TagModel,
     User as UserModel)
-from feeds import fetch_and_store_feed
+from feeds import (
+    build_source,
+    DEFAULT_HOST_LIMIT,
+    DEFAULT_WORKERS,
+    FetchQueue,
+    store_feed,
+    subscribe)
+from jobs import (
+    enqueue_job,
+    handles,
+    report_progress)
+from notify import publish_notice
 
 
-# TODO: Figure out proper type hint for opml_stream
-def import_opml(opml_stream, user_id: UUID) -> None:
-    """Imports the tags and feeds from an OPML file.
+LOOKUP_CHUNK_SIZE: int = 500
+PROGRESS_INTERVAL: int = 10  # feeds resolved between progress reports
+
+
+def import_opml(opml_stream: BinaryIO, user_id: UUID) -> int:
+    """Imports the tags and feeds from an OPML file. The file is read straight away, then the rest of the import is
+    queued as a job, so the feeds are fetched in the background.
 
     :param opml_stream: A file stream containing an OPML file.
     :param user_id: The id of the user importing the file.
+    :return: The ID of the import's job, to check on its progress.
+    """
+
+    subscriptions: Dict[str, Set[str]] = read_subscriptions(opml_stream)
+    payload: dict = {'subscriptions': {url: sorted(labels) for url, labels in subscriptions.items()}}
+    job_id: int = enqueue_job('opml', payload, user_id)
+    return job_id
+
+
+@handles('opml')
+def import_opml_job(job_id: int, user_id: UUID, payload: dict) -> None:
+    """Job handler that imports the feeds read from an OPML file.
+
+    Feeds that don't have a source yet are fetched concurrently, then every tag and subscription, and the entries of the
+    fetched feeds, are stored in one transaction.
+
+    :param job_id: The ID of the job.
+    :param user_id: The id of the user importing the file.
+    :param payload: The job's arguments, the "subscriptions" read by read_subscriptions, with the tag labels as lists.
+    """
+
+    subscriptions: Dict[str, Set[str]] = {url: set(labels) for url, labels in payload['subscriptions'].items()}
+    report_progress(job_id, 0, len(subscriptions))
+
+    feeds: Dict[str, FeedParserDict] = resolve_feeds(subscriptions, job_id)
+    store_subscriptions(subscriptions, feeds, user_id)
+
+    # let the user's browser know about the new entries
+    publish_notice()
+
+
+def read_subscriptions(opml_stream: BinaryIO) -> Dict[str, Set[str]]:
+    """Reads the feeds and the tags they're filed under from an OPML file, a piece at a time.
+
+    Tags are outlines that aren't feeds. They can be nested (thanks OPML), so a feed gets the labels of every tag it's
+    within.
+
+    :param opml_stream: A file stream containing an OPML file.
+    :return: The tag labels of each feed, keyed by feed URL.
     """
 
-    # get the body element from the stream
-    tree: ElementTree = parse(opml_stream)
-    root_element: Element = tree.getroot()
-    body: Element = root_element.find('body')
+    subscriptions: Dict[str, Set[str]] = {}
+    labels: List[Optional[str]] = []
+
+    for event, element in iterparse(opml_stream, events=('start', 'end')):
+        if element.tag != 'outline':
+            continue
+
+        # closing an outline, forget its tag, and what's been parsed of it
+        if event == 'end':
+            labels.pop()
+            element.clear()
+            continue
 
+        # is this a feed?
+        attrib: dict = element.attrib
+        url: Optional[str] = attrib.get('xmlUrl')
+        if attrib.get('type') == 'rss' and url:
+            subscriptions.setdefault(url, set()).update(label for label in labels if label)
+            labels.append(None)
+            continue
+
+        # if this isn't a feed, it's a tag
+        labels.append(attrib.get('text') or attrib.get('title'))
+
+    return subscriptions
+
+
+def resolve_feeds(feed_urls: Iterable[str], job_id: int) -> Dict[str, FeedParserDict]:
+    """Fetches the feeds that don't have a source yet, concurrently.
+
+    :param feed_urls: The URLs of the feeds.
+    :param job_id: The ID of the job to report progress on.
+    :return: The parsed feeds, keyed by URL.
+    """
+
+    urls: List[str] = list(feed_urls)
     with db_session:
-        user: UserModel = UserModel[user_id]
+        known: Set[str] = set(select_sources(urls))
+    new: List[str] = [url for url in urls if url not in known]
+
+    done: int = len(known)
+    report_progress(job_id, done)
+
+    feeds: Dict[str, FeedParserDict] = {}
+    with ThreadPoolExecutor(max_workers=DEFAULT_WORKERS) as executor:
+        fetches: FetchQueue = FetchQueue(executor, DEFAULT_HOST_LIMIT)
+        futures: Dict[Future, str] = {fetches.submit(url, '', ''): url for url in new}
+        for future in as_completed(futures):
+            feeds[futures.pop(future)] = future.result()
+            done += 1
+            if done % PROGRESS_INTERVAL == 0:
+                report_progress(job_id, done)
 
-        # recursively iterate through the outlines
-        for outline in body:
-            process_outline(outline, [], user)
+    report_progress(job_id, done)
+    return feeds
 
 
-def process_outline(outline: Element, current_tags: list, user: UserModel) -> None:
-    """Processes an OPML outline element. Feed elements will be added or updated as necessary, and child tags will be
-    recursively processed.
+def select_sources(urls: List[str]) -> Dict[str, SourceModel]:
+    """Selects the sources that already exist for the given feed URLs, a chunk of URLs at a time so the number of query
+    parameters stays within SQLite's limit. Must be called within a database session.
 
-    :param outline: The outline element to process
-    :param current_tags: Current tags in this branch of the XML tree
-    :param user: The user importing these feeds & tags
+    :param urls: The URLs of the feeds.
+    :return: The sources, keyed by URL.
     """
 
-    # get the attributes out of the outline
-    attrib: dict = outline.attrib
-
-    # is this a feed?
-    outline_type: str = attrib.get('type')
-    if outline_type is not None and outline_type == 'rss':
-        url: str = attrib.get('xmlUrl')
-        fetch_and_store_feed(url, current_tags, user)
-        return
-
-    # if this isn't a feed, it's a tag
-    text: str = attrib['text']
-    tag: Optional[TagModel] = TagModel.get(label=text, user=user)
-    if tag is None:
-        tag = TagModel(label=text, user=user)
-
-    # tags can be child elements of other tags (thanks OPML), so if this tag isn't already in the list of tags, add it
-    # also need to remember if this branch of the XML tree already has this tag, so we don't remove it prematurely
-    if tag in current_tags:
-        tag = None
-    else:
-        current_tags.append(tag)
-
-    # process child outlines
-    for child in outline:
-        process_outline(child, current_tags, user)
-
-    # remove the tag if this was the outermost instance of the tag
-    if tag is not None:
-        current_tags.remove(tag)
+    sources: Dict[str, SourceModel] = {}
+    for start in range(0, len(urls), LOOKUP_CHUNK_SIZE):
+        chunk: List[str] = urls[start:start + LOOKUP_CHUNK_SIZE]
+        sources.update((s.feed_uri, s) for s in select(s for s in SourceModel if s.feed_uri in chunk))
+
+    return sources
+
+
+def store_subscriptions(subscriptions: Dict[str, Set[str]], feeds: Dict[str, FeedParserDict], user_id: UUID) -> None:
+    """Stores the tags, sources and subscriptions of an import, in one transaction. New sources get the entries of the
+    feeds fetched for them, so they're ready to read once the import's done, like a feed that's added on its own.
+
+    :param subscriptions: The tag labels of each feed, keyed by feed URL.
+    :param feeds: The parsed feeds that don't have a source yet, keyed by URL.
+    :param user_id: The id of the user importing the file.
+    """
+
+    with db_session:
+        user: UserModel = UserModel[user_id]
+
+        # get or create each tag once, rather than once per feed
+        labels: Set[str] = set().union(*subscriptions.values())
+        tags: Dict[str, TagModel] = {t.label: t for t in select(t for t in TagModel if t.user == user)}
+        for label in labels - tags.keys():
+            tags[label] = TagModel(label=label, user=user)
+
+        # load the user's subscriptions up front, so checking for an existing one doesn't need a query per feed
+        user.sources.load()
+
+        sources: Dict[str, SourceModel] = select_sources(list(subscriptions))
+        for url, feed_labels in subscriptions.items():
+            source: Optional[SourceModel] = sources.get(url)
+            if source is None:
+                source = build_source(url, feeds.get(url, {}))
+                if url in feeds:
+                    source.flush()
+                    store_feed(source.id, feeds[url], Counter())
+
+            subscribe(source, [tags[label] for label in sorted(feed_labels)], user)
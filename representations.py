@@ -0,0 +1,159 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from flask import (
+    Response,
+    stream_with_context)
+from json import dumps
+from types import GeneratorType
+from typing import (
+    Any,
+    Iterator,
+    List,
+    Optional)
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, responses are only available as JSON without it
+    msgpack = None
+
+
+CHUNK_SIZE: int = 16384
+
+# the mimetypes responses can be encoded as, the default first
+MIMETYPES: List[str] = ['application/json'] if msgpack is None else ['application/json', 'application/msgpack']
+
+
+def buffer_chunks(chunks: Iterator[str], size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Joins small chunks of text into larger ones, so a stream isn't written out a few bytes at a time.
+
+    :param chunks: The chunks of text.
+    :param size: The minimum size of the joined chunks, apart from the last one.
+    :return: An iterator of the joined chunks.
+    """
+
+    buffer: List[str] = []
+    buffered: int = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+def encode_body(data: Any, mimetype: str) -> bytes:
+    """Encodes a whole body at once, for when it needs to be kept, rather than streamed.
+
+    :param data: The data to encode, see iter_json.
+    :param mimetype: The mimetype to encode the data as, one of MIMETYPES.
+    :return: The encoded body.
+    """
+
+    if mimetype == 'application/msgpack':
+        body: bytes = msgpack.packb(resolve(data), use_bin_type=True)
+        return body
+
+    body: bytes = ''.join(iter_json(resolve(data))).encode('utf-8')
+    return body
+
+
+def iter_json(value: Any) -> Iterator[str]:
+    """Encodes a value as JSON a piece at a time, so large responses never have to be held in memory in full.
+
+    Generators are encoded as arrays, an element at a time. Callables are called when their turn comes, so a value that
+    is only known once a generator before it has been exhausted, like a page's next cursor, can be included. Dicts are
+    walked to find either of these; everything else is encoded in one go.
+
+    :param value: The value to encode.
+    :return: An iterator of pieces of JSON text.
+    """
+
+    if callable(value):
+        value = value()
+
+    if isinstance(value, GeneratorType):
+        yield '['
+        separator: str = ''
+        for element in value:
+            yield separator + dumps(element)
+            separator = ', '
+        yield ']'
+    elif isinstance(value, dict):
+        yield '{'
+        separator: str = ''
+        for key, item in value.items():
+            yield f'{separator}{dumps(key)}: '
+            yield from iter_json(item)
+            separator = ', '
+        yield '}'
+    else:
+        yield dumps(value)
+
+
+def output_json(data: Any, code: int, headers: Optional[dict] = None) -> Response:
+    """Flask-RESTful representation that streams a JSON encoded body.
+
+    :param data: The data to encode, see iter_json.
+    :param code: The HTTP status code.
+    :param headers: Extra response headers.
+    :return: A streamed response.
+    """
+
+    # the body is generated after the view returns, so it needs the request context kept around
+    body: Iterator[str] = stream_with_context(buffer_chunks(iter_json(data)))
+    output: Response = Response(body, status=code, mimetype='application/json')
+    output.headers.extend(headers or {})
+    return output
+
+
+def output_msgpack(data: Any, code: int, headers: Optional[dict] = None) -> Response:
+    """Flask-RESTful representation with a MessagePack encoded body. A more compact alternative to JSON, for clients
+    that ask for it.
+
+    :param data: The data to encode, see iter_json.
+    :param code: The HTTP status code.
+    :param headers: Extra response headers.
+    :return: The response.
+    """
+
+    body: bytes = msgpack.packb(resolve(data), use_bin_type=True)
+    output: Response = Response(body, status=code, mimetype='application/msgpack')
+    output.headers.extend(headers or {})
+    return output
+
+
+def resolve(value: Any) -> Any:
+    """Turns data for iter_json into plain data, running generators and calling callables, for when it's needed all at
+    once.
+
+    :param value: The value to resolve.
+    :return: The value, with generators turned into lists and callables replaced by their results.
+    """
+
+    if callable(value):
+        value = value()
+
+    if isinstance(value, GeneratorType):
+        return [resolve(element) for element in value]
+
+    if isinstance(value, dict):
+        return {key: resolve(item) for key, item in value.items()}
+
+    return value
@@ -14,83 +14,573 @@
 
 
 from collections import OrderedDict
+from datetime import (
+    datetime,
+    timedelta)
+from hashlib import sha1
+from flask import (
+    g,
+    request,
+    Response)
 from flask_login import (
     current_user,
     login_required)
 from flask_restful import (
+    abort,
     fields,
     marshal,
+    reqparse,
     Resource)
 from pony.orm import (
+    count,
     db_session,
     desc,
-    select)
+    exists,
+    select,
+    sum)
 from pony.orm.core import Query
 from typing import (
     Callable,
-    List)
-
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple)
+from uuid import UUID
+
+from cache import timeline_cache
+from compression import (
+    choose_encoding,
+    compress_body)
 from database import (
+    db,
     Entry as EntryModel,
+    Job as JobModel,
     SourceUserData as SourceUserDataModel,
     Tag as TagModel,
+    TimelineItem as TimelineItemModel,
     User as UserModel)
+from representations import (
+    encode_body,
+    MIMETYPES)
+from search import search_entries
+from timeline import timeline_enabled
+
+
+QUERY_CHUNK_SIZE: int = 500
 
 
-def get_user_data_for_entry(entry: EntryModel) -> SourceUserDataModel:
-    """Gets the source user data for the given entry's source and the logged-in user.
+def get_source_for_entry(entry: EntryModel) -> dict:
+    """Gets the display data of the given entry's source, from the map built by get_sources_for_user for this request.
 
     :param entry: The entry who's source we're looking up.
-    :return: The related source user data.
+    :return: The source's display data.
     """
 
-    user: UserModel = UserModel[current_user.user_id]
-    user_data: SourceUserDataModel = SourceUserDataModel.get(source=entry.source, user=user)
+    source: dict = g.entry_sources[entry.source.id]
+    return source
+
+
+def get_sources_for_user(user: UserModel) -> Dict[int, dict]:
+    """Builds the display data of every source the user is subscribed to, with a fixed number of queries regardless of
+    the number of sources or tags.
+
+    :param user: The user whose subscriptions to look up.
+    :return: The display data of each source, keyed by source ID.
+    """
+
+    subscriptions: Query = select((d.source.id, d.source.link, d.user_label, d.source.fetched_label)
+                                  for d in SourceUserDataModel if d.user == user)
+    sources: Dict[int, dict] = {source_id: {'id': source_id, 'label': user_label or fetched_label, 'link': link,
+                                            'tags': []}
+                                for source_id, link, user_label, fetched_label in subscriptions}
+
+    tags: Query = select((d.source.id, t.label) for d in SourceUserDataModel for t in d.tags if d.user == user)
+    for source_id, label in tags:
+        sources[source_id]['tags'].append(label)
 
-    return user_data
+    return sources
+
+
+def iter_query(query: Query, chunk_size: int = QUERY_CHUNK_SIZE) -> Iterator:
+    """Iterates over the results of a query, fetching them a chunk at a time rather than all at once. The query needs to
+    be ordered, so the chunks don't overlap.
+
+    :param query: The ordered query.
+    :param chunk_size: The number of results to fetch at a time.
+    :return: An iterator of the results.
+    """
+
+    page: int = 1
+    while True:
+        chunk: List = query.page(page, chunk_size)
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+
+        page += 1
 
 
 # entries
 
+DEFAULT_PAGE_SIZE: int = 100
+MAX_ENTRY_ID: int = 2 ** 63 - 1  # SQLite's largest integer
+MAX_PAGE_SIZE: int = 500
+SOURCES_PER_QUERY: int = 100  # of a filtered timeline, well within SQLite's limits on unions and parameters
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decodes a page cursor back into the updated time and ID of the last entry of the previous page.
+
+    :param cursor: The cursor, as generated by encode_cursor.
+    :return: The updated time and ID the next page should start after.
+    """
+
+    # a time outside of what datetime can hold overflows, as would an ID outside of what SQLite can
+    try:
+        micros, entry_id = (int(part) for part in cursor.split('.'))
+        updated: datetime = datetime.min + timedelta(microseconds=micros)
+    except (OverflowError, ValueError):
+        abort(400, message='Invalid cursor.')
+
+    if abs(entry_id) > MAX_ENTRY_ID:
+        abort(400, message='Invalid cursor.')
+
+    return updated, entry_id
+
+
+def encode_cursor(entry: EntryModel) -> str:
+    """Encodes a page cursor from the last entry of a page.
+
+    The updated time is stored as microseconds since datetime.min, so it doesn't depend on date formatting.
+
+    :param entry: The last entry of the page.
+    :return: An opaque cursor string.
+    """
+
+    micros: int = (entry.updated - datetime.min) // timedelta(microseconds=1)
+    cursor: str = f'{micros}.{entry.id}'
+    return cursor
+
+
+entries_parser: reqparse.RequestParser = reqparse.RequestParser()
+entries_parser.add_argument('cursor', type=str)
+entries_parser.add_argument('limit', type=int, default=DEFAULT_PAGE_SIZE)
+entries_parser.add_argument('since', type=int)
+entries_parser.add_argument('source', type=int, action='append')
+entries_parser.add_argument('tag', type=int, action='append')
+
 source_in_entry_fields: dict = {
-    'id': fields.Integer(attribute='source.id'),
-    'link': fields.String(attribute='source.link'),
+    'id': fields.Integer,
+    'link': fields.String,
     'label': fields.String,
-    'tags': fields.List(fields.String(attribute='label'))
+    'tags': fields.List(fields.String)
 }
 
 
 entry_fields: dict = {
+    'excerpt': fields.String,
+    'id': fields.Integer,
+    'link': fields.String,
+    'source': fields.Nested(source_in_entry_fields, attribute=get_source_for_entry),
+    'title': fields.String,
+    'updated': fields.DateTime
+}
+
+
+entry_detail_fields: dict = {
     'id': fields.Integer,
     'link': fields.String,
-    'source': fields.Nested(source_in_entry_fields, attribute=get_user_data_for_entry),
+    'source': fields.Nested(source_in_entry_fields, attribute=get_source_for_entry),
     'summary': fields.String,
     'title': fields.String,
     'updated': fields.DateTime
 }
 
 
+def select_filtered_sources(user: UserModel, source_ids: Optional[List[int]],
+                            tag_ids: Optional[List[int]]) -> List[int]:
+    """Selects which of a user's subscriptions a filtered timeline covers. Must be called within a database session.
+
+    :param user: The user whose subscriptions to select from.
+    :param source_ids: Only select these sources, None for any source.
+    :param tag_ids: Only select sources the user has given any of these tags, None for any source.
+    :return: The IDs of the selected sources.
+    """
+
+    subscriptions: Query = select(d for d in SourceUserDataModel if d.user == user)
+    if source_ids is not None:
+        subscriptions = subscriptions.filter(lambda d: d.source.id in source_ids)
+    if tag_ids is not None:
+        subscriptions = subscriptions.filter(lambda d: exists(t for t in d.tags if t.id in tag_ids))
+
+    selected: List[int] = [d.source.id for d in subscriptions]
+    return selected
+
+
+def select_materialized_timeline(user: UserModel, cursor: Optional[Tuple[datetime, int]], since: Optional[int],
+                                 limit: int) -> List[EntryModel]:
+    """Selects a page of a user's timeline from their materialized timeline, as a range scan of their rows. Must be
+    called within a database session.
+
+    :param user: The user whose timeline to select from.
+    :param cursor: The updated time and ID of the last entry of the previous page, None for the first page.
+    :param since: Only select entries with a greater ID than this, None for all entries.
+    :param limit: The maximum number of entries in the page.
+    :return: Up to one more entry than the limit, newest first.
+    """
+
+    items: Query = select(t for t in TimelineItemModel if t.user == user)
+
+    # only entries added since the client's last look
+    if since is not None:
+        items = items.filter(lambda t: t.entry.id > since)
+
+    # continue after the last entry of the previous page, reading the user's rows from the cursor's updated time on
+    if cursor is not None:
+        updated, entry_id = cursor
+        items = items.filter(lambda t: t.updated <= updated and
+                             (t.updated < updated or (t.updated == updated and t.entry.id < entry_id)))
+
+    # get one more than the page needs, to know if there's a next page, then load their entries in one go
+    items = items.order_by(desc(TimelineItemModel.updated), desc(TimelineItemModel.entry))
+    entry_ids: List[int] = [item.entry.id for item in items[:limit + 1]]
+    loaded: Dict[int, EntryModel] = {e.id: e for e in EntryModel.select(lambda e: e.id in entry_ids)}
+    entries: List[EntryModel] = [loaded[entry_id] for entry_id in entry_ids]
+    return entries
+
+
+def select_sources_timeline(source_ids: List[int], cursor: Optional[Tuple[datetime, int]], since: Optional[int],
+                            limit: int) -> List[EntryModel]:
+    """Selects a page of the entries of a set of sources, as for a filtered timeline. Must be called within a database
+    session.
+
+    Each source's entries are read newest first from the (source, updated) index, taking no more than a page's worth
+    from any one of them, so a page costs the same however many entries the sources have had. The sources' pages are
+    then merged, a chunk of sources at a time, which keeps the queries within SQLite's limits.
+
+    :param source_ids: The IDs of the sources to select from.
+    :param cursor: The updated time and ID of the last entry of the previous page, None for the first page.
+    :param since: Only select entries with a greater ID than this, None for all entries.
+    :param limit: The maximum number of entries in the page.
+    :return: Up to one more entry than the limit, newest first.
+    """
+
+    # one more than the page needs, to know if there's a next page
+    size: int = limit + 1
+    arguments: dict = {'size': size, 'since': since}
+    conditions: str = ''
+
+    # only entries added since the client's last look
+    if since is not None:
+        conditions += ' AND "id" > $since'
+
+    # continue after the last entry of the previous page, reading from the cursor's updated time on
+    if cursor is not None:
+        arguments['updated'], arguments['entry_id'] = cursor
+        conditions += (' AND "updated" <= $updated'
+                       ' AND ("updated" < $updated OR "updated" = $updated AND "id" < $entry_id)')
+
+    entries: List[EntryModel] = []
+    for start in range(0, len(source_ids), SOURCES_PER_QUERY):
+        chunk: List[int] = source_ids[start:start + SOURCES_PER_QUERY]
+        arguments.update({f'source_{index}': source_id for index, source_id in enumerate(chunk)})
+        pages: List[str] = [f'SELECT * FROM (SELECT * FROM "Entry" WHERE "source" = $source_{index}{conditions}'
+                            f' ORDER BY "updated" DESC, "id" DESC LIMIT $size)' for index in range(len(chunk))]
+        sql: str = ' UNION ALL '.join(pages) + ' ORDER BY "updated" DESC, "id" DESC LIMIT $size'
+        entries.extend(EntryModel.select_by_sql(sql, globals=arguments))
+
+    entries.sort(key=lambda entry: (entry.updated, entry.id), reverse=True)
+    return entries[:size]
+
+
+def select_timeline(user: UserModel, cursor: Optional[Tuple[datetime, int]], since: Optional[int], limit: int,
+                    source_ids: Optional[List[int]] = None) -> List[EntryModel]:
+    """Selects a page of a user's timeline by joining the entries against their subscriptions. Must be called within a
+    database session.
+
+    :param user: The user whose timeline to select from.
+    :param cursor: The updated time and ID of the last entry of the previous page, None for the first page.
+    :param since: Only select entries with a greater ID than this, None for all entries.
+    :param limit: The maximum number of entries in the page.
+    :param source_ids: Only select entries from these sources, as given by select_filtered_sources, None for entries
+        from all of the user's sources.
+    :return: Up to one more entry than the limit, newest first.
+    """
+
+    # a filtered timeline's sources are read one by one, each only as far as the page needs
+    if source_ids is not None:
+        return select_sources_timeline(source_ids, cursor, since, limit)
+
+    # get a list of entries from sources of feeds followed by the user
+    sources: Query = select(s.source for s in user.sources)
+    result: Query = select(e for e in EntryModel if e.source in sources)
+
+    # only entries added since the client's last look
+    if since is not None:
+        result = result.filter(lambda e: e.id > since)
+
+    # continue after the last entry of the previous page; the range on its own lets the index be read from the cursor
+    # on, rather than from the newest entry, while the rest picks out where among entries of the same time to go on
+    if cursor is not None:
+        updated, entry_id = cursor
+        result = result.filter(lambda e: e.updated <= updated and
+                               (e.updated < updated or (e.updated == updated and e.id < entry_id)))
+
+    # get one more than the page needs, to know if there's a next page
+    result = result.order_by(desc(EntryModel.updated), desc(EntryModel.id))
+    entries: List[EntryModel] = list(result[:limit + 1])
+    return entries
+
+
+def get_entries_page(user_id: UUID, cursor: Optional[Tuple[datetime, int]], since: Optional[int], limit: int,
+                     source_ids: Optional[List[int]] = None, tag_ids: Optional[List[int]] = None) -> dict:
+    """Gets a page of feed entries for sources the given user is subscribed to, newest first. Unfiltered pages are read
+    from the materialized timeline if MATERIALIZED_TIMELINE is on.
+
+    The entries are generated lazily, within a database session of their own, so they can be streamed out as they're
+    marshalled. The next cursor and latest entry ID are only known once the entries have been generated, so they're
+    given as callables.
+
+    :param user_id: The ID of the user whose entries to get.
+    :param cursor: The updated time and ID of the last entry of the previous page, None for the first page.
+    :param since: Only get entries with a greater ID than this, None for all entries.
+    :param limit: The maximum number of entries in the page.
+    :param source_ids: Only get entries from these sources, None for entries from any source.
+    :param tag_ids: Only get entries from sources with any of these tags, None for entries from any source.
+    :return: The page, as a dict of a generator of the page's entries as JSON-serializable dicts, the next cursor, and
+        the latest entry ID.
+    """
+
+    state: dict = {'latest': since or 0, 'next': None}
+    filtered: bool = source_ids is not None or tag_ids is not None
+    materialized: bool = timeline_enabled() and not filtered
+
+    def generate_entries() -> Iterator[OrderedDict]:
+        with db_session:
+            # the latest entry ID of all, rather than of the timeline, as it's read straight from the end of the
+            # table's primary key; it's read first, so no entry up to it can be missing from the page
+            latest: Optional[int] = select(e.id for e in EntryModel).max()
+            state['latest'] = max(latest or 0, since or 0)
+
+            user: UserModel = UserModel[user_id]
+            if filtered:
+                selected: List[int] = select_filtered_sources(user, source_ids, tag_ids)
+                entries: List[EntryModel] = select_timeline(user, cursor, since, limit, selected)
+            elif materialized:
+                entries: List[EntryModel] = select_materialized_timeline(user, cursor, since, limit)
+            else:
+                entries: List[EntryModel] = select_timeline(user, cursor, since, limit)
+
+            # look up the display data of all the user's sources up front, rather than once per entry
+            g.entry_sources = get_sources_for_user(user)
+
+            # there's a next page if there was more than a page's worth
+            if len(entries) > limit:
+                state['next'] = encode_cursor(entries[limit - 1])
+
+            # marshall them to JSON-serializable dicts, one at a time
+            for entry in entries[:limit]:
+                yield marshal(entry, entry_fields)
+
+    output: dict = {
+        'entries': generate_entries(),
+        'next': lambda: state['next'],
+        'latest': lambda: state['latest']
+    }
+    return output
+
+
+def get_timeline_version(user_id: UUID) -> str:
+    """Gets a token that changes whenever anything shown in the given user's timelines does: their subscriptions, or the
+    entries or labels of the sources they're subscribed to.
+
+    :param user_id: The ID of the user.
+    :return: The version token.
+    """
+
+    with db_session:
+        user: UserModel = UserModel[user_id]
+        subscriptions, source_versions = select((count(d), sum(d.source.version))
+                                                for d in SourceUserDataModel if d.user == user).get()
+        version: str = f'{user.version}.{subscriptions}.{source_versions or 0}'
+        return version
+
+
 class Entries(Resource):
     """REST endpoint for feed entries."""
 
     decorators: List[Callable] = [login_required]
 
     @staticmethod
-    def get() -> List[OrderedDict]:
-        """Returns all feed entries for sources the logged-in user is subscribed to.
+    def get() -> Response:
+        """Returns a page of feed entries for sources the logged-in user is subscribed to, newest first.
+
+        Pages are keyset paginated on (updated, id). Pass the "next" value of a page as the "cursor" argument to get the
+        following page; it's null on the last page.
 
-        :return: The entries, as a list of JSON-serializable dicts.
+        Entry IDs only ever increase, so passing the "latest" value of a response as the "since" argument limits the
+        results to entries added after that response.
+
+        The "tag" and "source" arguments, each of which can be given more than once, limit the results to entries from
+        sources with any of the given tag IDs, and from any of the given source IDs.
+
+        Encoded pages are cached, compressed, until the user's timeline version changes, and carry a strong ETag of it
+        and of the encodings, so a client sending the ETag back in If-None-Match gets a 304 while the page is unchanged.
+
+        :return: The entries, as a response with a body of the page of entries, the next cursor, and the latest entry
+            ID.
+        """
+
+        args: dict = entries_parser.parse_args()
+        cursor: Optional[Tuple[datetime, int]] = decode_cursor(args['cursor']) if args['cursor'] is not None else None
+        limit: int = min(max(args['limit'], 1), MAX_PAGE_SIZE)
+
+        # the page only changes when the timeline version does, so that and what was asked for identify it
+        user_id: UUID = current_user.user_id
+        mimetype: str = request.accept_mimetypes.best_match(MIMETYPES, default=MIMETYPES[0])
+        encoding: Optional[str] = choose_encoding()
+        version: str = get_timeline_version(user_id)
+        etag: str = sha1(f'{user_id}|{version}|{request.full_path}|{mimetype}|{encoding}'.encode('utf-8')).hexdigest()
+
+        if request.if_none_match.contains(etag):
+            output: Response = Response(status=304)
+        else:
+            # pages are cached compressed, so a hit isn't compressed again
+            key: tuple = (user_id, request.full_path, mimetype, encoding)
+            cached: Optional[Tuple[bytes, Optional[str]]] = timeline_cache.get(key, version)
+            if cached is None:
+                page: dict = get_entries_page(user_id, cursor, args['since'], limit, args['source'], args['tag'])
+                cached = compress_body(encode_body(page, mimetype), encoding)
+                timeline_cache.put(key, version, *cached)
+
+            body, content_encoding = cached
+            output: Response = Response(body, mimetype=mimetype)
+            if content_encoding is not None:
+                output.headers['Content-Encoding'] = content_encoding
+
+        output.set_etag(etag)
+        output.vary.add('Accept')
+        output.vary.add('Accept-Encoding')
+        return output
+
+
+class EntryDetail(Resource):
+    """REST endpoint for a single feed entry, with its full summary."""
+
+    decorators: List[Callable] = [login_required]
+
+    @staticmethod
+    def get(entry_id: int) -> OrderedDict:
+        """Returns a feed entry, if it's from a source the logged-in user is subscribed to.
+
+        :param entry_id: The ID of the entry.
+        :return: The entry, as a JSON-serializable dict.
         """
 
         with db_session:
-            # get a list of entries from sources of feeds followed by the logged-in user
             user: UserModel = UserModel[current_user.user_id]
-            sources: Query = select(s.source for s in user.sources)
-            result: Query = select(e for e in EntryModel if e.source in sources).order_by(desc(EntryModel.updated))
-            entries: List[EntryModel] = list(result)
+            g.entry_sources = get_sources_for_user(user)
+
+            entry: Optional[EntryModel] = EntryModel.get(id=entry_id)
+            if entry is None or entry.source.id not in g.entry_sources:
+                abort(404, message='Entry not found.')
+
+            # marshall it to a JSON-serializable dict
+            output: OrderedDict = marshal(entry, entry_detail_fields)
+            return output
+
+
+# entry search
+
+search_parser: reqparse.RequestParser = reqparse.RequestParser()
+search_parser.add_argument('q', type=str, required=True)
+search_parser.add_argument('limit', type=int, default=DEFAULT_PAGE_SIZE)
+search_parser.add_argument('offset', type=int, default=0)
+
+
+class EntrySearch(Resource):
+    """REST endpoint for searching feed entries."""
+
+    decorators: List[Callable] = [login_required]
+
+    @staticmethod
+    def get() -> dict:
+        """Returns a page of the feed entries matching a search, from sources the logged-in user is subscribed to, best
+        matches first.
+
+        Every word in the "q" argument has to be in an entry's title or summary for it to match. Pass the "next" value
+        of a page as the "offset" argument to get the following page; it's null on the last page.
+
+        :return: The entries, as a JSON-serializable dict of the page of entries, each with a snippet of the matching
+            text, and the next offset.
+        """
+
+        args: dict = search_parser.parse_args()
+        limit: int = min(max(args['limit'], 1), MAX_PAGE_SIZE)
+        offset: int = max(args['offset'], 0)
+
+        with db_session:
+            user: UserModel = UserModel[current_user.user_id]
+            g.entry_sources = get_sources_for_user(user)
+
+            # get one more than the page needs, to know if there's a next page
+            results: List[Tuple[int, str]] = search_entries(db, args['q'], g.entry_sources, limit + 1, offset)
+            next_offset: Optional[int] = offset + limit if len(results) > limit else None
+            results = results[:limit]
+
+            # load the matched entries, keeping the search's order
+            entry_ids: List[int] = [entry_id for entry_id, _ in results]
+            entries: Dict[int, EntryModel] = {e.id: e for e in EntryModel.select(lambda e: e.id in entry_ids)}
 
             # marshall them to JSON-serializable dicts
-            output: List[OrderedDict] = marshal(entries, entry_fields)
+            matches: List[OrderedDict] = []
+            for entry_id, snippet in results:
+                match: OrderedDict = marshal(entries[entry_id], entry_fields)
+                match['snippet'] = snippet
+                matches.append(match)
+
+            output: dict = {
+                'entries': matches,
+                'next': next_offset
+            }
+            return output
+
+
+# jobs
+
+job_fields: dict = {
+    'created': fields.DateTime,
+    'done': fields.Integer,
+    'error': fields.String,
+    'finished': fields.DateTime,
+    'id': fields.Integer,
+    'kind': fields.String,
+    'status': fields.String,
+    'total': fields.Integer
+}
+
+
+class JobStatus(Resource):
+    """REST endpoint for the progress of a background job."""
+
+    decorators: List[Callable] = [login_required]
+
+    @staticmethod
+    def get(job_id: int) -> OrderedDict:
+        """Returns a background job started by the logged-in user, with how far it's got.
+
+        :param job_id: The ID of the job.
+        :return: The job, as a JSON-serializable dict.
+        """
+
+        with db_session:
+            job: Optional[JobModel] = JobModel.get(id=job_id)
+            if job is None or job.user is None or job.user.user_id != current_user.user_id:
+                abort(404, message='Job not found.')
+
+            # marshall it to a JSON-serializable dict
+            output: OrderedDict = marshal(job, job_fields)
             return output
 
 
@@ -121,20 +611,26 @@ class Sources(Resource):
     decorators = [login_required]
 
     @staticmethod
-    def get() -> List[OrderedDict]:
+    def get() -> Iterator[OrderedDict]:
         """Returns all sources the logged-in user is subscribed to.
 
-        :return: The sources, as a list of JSON-serializable dicts.
+        :return: The sources, as a generator of JSON-serializable dicts.
         """
 
-        with db_session:
-            # get a list of sources followed by the logged-in user
-            user: UserModel = UserModel[current_user.user_id]
-            sources: List[SourceUserDataModel] = list(user.sources)
+        user_id: UUID = current_user.user_id
 
-            # marshall them to JSON-serializable dicts
-            output: List[OrderedDict] = marshal(sources, source_fields)
-            return output
+        def generate_sources() -> Iterator[OrderedDict]:
+            with db_session:
+                # get the sources followed by the logged-in user
+                user: UserModel = UserModel[user_id]
+                sources: Query = select(s for s in SourceUserDataModel if s.user == user)
+                sources = sources.order_by(SourceUserDataModel.id)
+
+                # marshall them to JSON-serializable dicts, one at a time
+                for source in iter_query(sources):
+                    yield marshal(source, source_fields)
+
+        return generate_sources()
 
 
 # tags
@@ -151,17 +647,22 @@ class Tags(Resource):
     decorators = [login_required]
 
     @staticmethod
-    def get() -> List[OrderedDict]:
+    def get() -> Iterator[OrderedDict]:
         """Returns all tags defined by the logged-in user.
 
-        :return: The tags, as a list of JSON-serializable dicts.
+        :return: The tags, as a generator of JSON-serializable dicts.
         """
 
-        with db_session:
-            # get tags from the user
-            user: UserModel = UserModel[current_user.user_id]
-            tags: List[TagModel] = list(user.tags)
+        user_id: UUID = current_user.user_id
 
-            # marshall them to JSON-serializable dicts
-            output: List[OrderedDict] = marshal(tags, tag_fields)
-            return output
+        def generate_tags() -> Iterator[OrderedDict]:
+            with db_session:
+                # get tags from the user
+                user: UserModel = UserModel[user_id]
+                tags: Query = select(t for t in TagModel if t.user == user).order_by(TagModel.id)
+
+                # marshall them to JSON-serializable dicts, one at a time
+                for tag in iter_query(tags):
+                    yield marshal(tag, tag_fields)
+
+        return generate_tags()
@@ -0,0 +1,119 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import (
+    datetime,
+    timedelta)
+from gzip import open as open_gzip
+from json import dumps
+from pony.orm import (
+    Database,
+    db_session)
+from typing import List
+
+
+DEFAULT_BATCH_SIZE: int = 1000
+
+
+def archive_entries(db: Database, entry_ids: List[int], archive_path: str) -> None:
+    """Appends entries to a gzip compressed archive, one JSON object per line. Must be called within a database session.
+
+    :param db: The bound database.
+    :param entry_ids: IDs of the entries to archive.
+    :param archive_path: Path of the archive file.
+    """
+
+    ids: str = ', '.join(str(int(entry_id)) for entry_id in entry_ids)
+    rows: List[tuple] = db.select(f'''SELECT "Entry"."id", "Source"."feed_uri", "Entry"."guid", "Entry"."link",
+            "Entry"."title", "Entry"."updated", "Entry"."summary"
+        FROM "Entry" JOIN "Source" ON "Source"."id" = "Entry"."source"
+        WHERE "Entry"."id" IN ({ids})''')
+
+    with open_gzip(archive_path, 'at', encoding='utf-8') as archive:
+        for entry_id, feed_uri, guid, link, title, updated, summary in rows:
+            record: dict = {'id': entry_id, 'feed_uri': feed_uri, 'guid': guid, 'link': link, 'title': title,
+                            'updated': updated, 'summary': summary}
+            archive.write(dumps(record) + '\n')
+
+
+def delete_entries(db: Database, entry_ids: List[int], archive_path: str) -> None:
+    """Deletes entries, archiving them first if there's an archive, and remembering them as pruned. Must be called
+    within a database session.
+
+    :param db: The bound database.
+    :param entry_ids: IDs of the entries to delete.
+    :param archive_path: Path of the archive file, empty to not archive.
+    """
+
+    if archive_path:
+        archive_entries(db, entry_ids, archive_path)
+
+    ids: str = ', '.join(str(int(entry_id)) for entry_id in entry_ids)
+
+    # invalidate cached timelines that include the entries' sources
+    db.execute(f'UPDATE "Source" SET "version" = "version" + 1 '
+               f'WHERE "id" IN (SELECT "source" FROM "Entry" WHERE "id" IN ({ids}))')
+    # remember what's deleted, so the entries still in their feeds aren't stored again as new ones
+    db.execute(f'INSERT OR IGNORE INTO "PrunedEntry" ("guid", "source") '
+               f'SELECT "guid", "source" FROM "Entry" WHERE "id" IN ({ids})')
+    db.execute(f'DELETE FROM "TimelineItem" WHERE "entry" IN ({ids})')
+    db.execute(f'DELETE FROM "Entry" WHERE "id" IN ({ids})')
+
+
+def prune_entries(db: Database, days: int, per_source: int, archive_path: str,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Deletes the entries that are past the retention limits, in batches that are each committed on their own, so
+    neither the web app nor the updater are held up for long.
+
+    :param db: The bound database.
+    :param days: Delete entries last updated more than this many days ago. 0 to not limit by age.
+    :param per_source: Delete all but the newest this many entries of each source. 0 to not limit by count.
+    :param archive_path: Path of a gzip compressed file to append deleted entries to, empty to not archive.
+    :param batch_size: Number of entries to delete per transaction.
+    :return: The number of entries deleted.
+    """
+
+    deleted: int = 0
+
+    # entries that are too old; stored the way Pony stores date-times, so they compare as strings
+    if days > 0:
+        cutoff: str = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        while True:
+            with db_session:
+                entry_ids: List[int] = db.select('SELECT "id" FROM "Entry" WHERE "updated" < $cutoff LIMIT $batch_size')
+                if not entry_ids:
+                    break
+
+                delete_entries(db, entry_ids, archive_path)
+                deleted += len(entry_ids)
+
+    # entries beyond the newest of each source; a source at a time, so the (source, updated) index can be used
+    if per_source > 0:
+        with db_session:
+            source_ids: List[int] = db.select('SELECT "id" FROM "Source"')
+
+        for source_id in source_ids:
+            while True:
+                with db_session:
+                    entry_ids: List[int] = db.select('''SELECT "id" FROM "Entry" WHERE "source" = $source_id
+                        ORDER BY "updated" DESC, "id" DESC
+                        LIMIT $batch_size OFFSET $per_source''')
+                    if not entry_ids:
+                        break
+
+                    delete_entries(db, entry_ids, archive_path)
+                    deleted += len(entry_ids)
+
+    return deleted
@@ -17,28 +17,42 @@ from flask import (
     flash,
     redirect,
     render_template,
+    request,
+    stream_with_context,
     url_for)
 from flask_login import (
     current_user,
     login_required,
     login_user,
     logout_user)
+from json import dumps
 from pony.orm import db_session
+from typing import (
+    Iterator,
+    Optional)
+from uuid import UUID
 from werkzeug.security import check_password_hash
 from werkzeug.wrappers.response import Response
 
 from database import User as UserModel
-from feeds import fetch_and_store_feed
 from forms import (
     AddFeedForm,
     LoginForm,
     OpmlUploadForm)
+from jobs import enqueue_job
 from login import User
+from notify import (
+    latest_notice,
+    wait_for_notices)
 from opml import import_opml
+from representations import resolve
+from rest import (
+    get_entries_page,
+    MAX_PAGE_SIZE)
 
 
 def add_feed() -> Response:
-    """Add feed route. Takes a URL, tries to fetch it as a feed, then adding or updating a source for that feed as
+    """Add feed route. Takes a URL, and queues a job to fetch it as a feed, then add or update a source for that feed as
     necessary.
 
     :return: A redirect to the landing page.
@@ -54,11 +68,55 @@ def add_feed() -> Response:
         flash('Invalid feed.', 'warning')
         return output
 
-    url: str = form.url.data
-    with db_session:
-        user: UserModel = UserModel[current_user.user_id]
-        fetch_and_store_feed(url, [], user)
+    # fetch the feed in the background, the job's progress is at /jobs/<id>
+    job_id: int = enqueue_job('add_feed', {'url': form.url.data}, current_user.user_id)
+    flash(f'Adding feed. Progress: {url_for("jobstatus", job_id=job_id)}', 'info')
+
+    return output
+
+
+@login_required
+def entries_stream() -> Response:
+    """Entry stream route. Pushes new entries from the logged-in user's sources as server-sent events, as updates store
+    them.
+
+    Each "entries" event has the same data as a response from the entries REST endpoint, with entries added since the
+    previous event. When more have been added than fit in a page, a "reload" event, with just the latest entry ID, is
+    sent instead, for the client to reload its timeline. The event ID is the latest entry ID, so a reconnecting client
+    picks up where it left off.
+
+    :return: A streamed text/event-stream response.
+    """
+
+    # start after what the client last saw, or from now if it doesn't say
+    since_text: Optional[str] = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since: int = int(since_text)
+    except (TypeError, ValueError):
+        since: int = latest_notice()
+
+    user_id: UUID = current_user.user_id
+
+    def events(since: int) -> Iterator[str]:
+        for latest in wait_for_notices(since):
+            if latest is None:
+                yield ': keep-alive\n\n'
+                continue
+
+            # the notice may not have anything from this user's sources
+            page: dict = resolve(get_entries_page(user_id, None, since, MAX_PAGE_SIZE))
+            since = max(since, page['latest'])
+            if page['next'] is not None:
+                yield f'id: {since}\nevent: reload\ndata: {dumps({"latest": since})}\n\n'
+                continue
+
+            if not page['entries']:
+                continue
+
+            yield f'id: {since}\nevent: entries\ndata: {dumps(page)}\n\n'
 
+    output: Response = Response(stream_with_context(events(since)), mimetype='text/event-stream')
+    output.headers['Cache-Control'] = 'no-cache'
     return output
 
 
@@ -128,7 +186,7 @@ def root() -> str:
 
 @login_required
 def upload_opml() -> Response:
-    """OPML upload route. Handles the posting of an OPML file for importing feeds.
+    """OPML upload route. Handles the posting of an OPML file for importing feeds, which carries on in the background.
 
     :return: A redirect to the landing page.
     """
@@ -143,7 +201,8 @@ def upload_opml() -> Response:
         flash('Form bad', 'warning')
         return output
 
-    # import the feeds
-    import_opml(form.opml.data.stream, current_user.user_id)
+    # import the feeds in the background, the job's progress is at /jobs/<id>
+    job_id: int = import_opml(form.opml.data.stream, current_user.user_id)
+    flash(f'Importing feeds. Progress: {url_for("jobstatus", job_id=job_id)}', 'info')
 
     return output
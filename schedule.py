@@ -0,0 +1,150 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from calendar import timegm
+from datetime import (
+    datetime,
+    timedelta)
+from feedparser import FeedParserDict
+from time import struct_time
+from typing import (
+    Dict,
+    List,
+    Optional)
+
+from database import Source as SourceModel
+
+
+DEFAULT_INTERVAL: timedelta = timedelta(hours=1)
+MAX_BACKOFF: timedelta = timedelta(days=7)
+MAX_INTERVAL: timedelta = timedelta(days=1)
+MIN_INTERVAL: timedelta = timedelta(minutes=15)
+SAMPLE_SIZE: int = 10
+
+UPDATE_PERIODS: Dict[str, timedelta] = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+    'monthly': timedelta(days=30),
+    'yearly': timedelta(days=365)
+}
+
+
+def backoff_interval(error_count: int) -> timedelta:
+    """Works out how long to wait before retrying a source that keeps failing.
+
+    :param error_count: Number of consecutive failed fetches.
+    :return: The time to wait, doubling with each failure.
+    """
+
+    # cap the exponent too, so a long dead feed can't overflow the multiplication
+    interval: timedelta = MIN_INTERVAL * 2 ** min(error_count, 16)
+    return min(interval, MAX_BACKOFF)
+
+
+def hinted_interval(feed_info: dict) -> Optional[timedelta]:
+    """Gets the shortest polling interval the feed allows, from RSS ttl and sy:updatePeriod/sy:updateFrequency.
+
+    :param feed_info: The feed-level data of a parsed feed.
+    :return: The interval the feed asks for, or None if it doesn't say.
+    """
+
+    hints: List[timedelta] = []
+
+    # ttl is in minutes
+    try:
+        hints.append(timedelta(minutes=int(feed_info['ttl'])))
+    except (KeyError, ValueError):
+        pass
+
+    # the syndication module gives a period, and a number of updates within that period
+    period: Optional[timedelta] = UPDATE_PERIODS.get(feed_info.get('sy_updateperiod', '').strip().lower())
+    if period is not None:
+        try:
+            frequency: int = max(int(feed_info.get('sy_updatefrequency', 1)), 1)
+        except ValueError:
+            frequency: int = 1
+        hints.append(period / frequency)
+
+    if not hints:
+        return None
+
+    return max(hints)
+
+
+def publish_interval(entries: List[FeedParserDict]) -> Optional[timedelta]:
+    """Estimates how often a feed publishes, from the dates of its most recent entries.
+
+    :param entries: The entries of a parsed feed.
+    :return: The average time between entries, or None if there aren't enough dated entries to tell.
+    """
+
+    dates: List[struct_time] = [e['updated_parsed'] for e in entries if e.get('updated_parsed')]
+    timestamps: List[int] = sorted((timegm(d) for d in dates), reverse=True)[:SAMPLE_SIZE]
+    if len(timestamps) < 2:
+        return None
+
+    span: int = timestamps[0] - timestamps[-1]
+    interval: timedelta = timedelta(seconds=span / (len(timestamps) - 1))
+    return interval
+
+
+def schedule_failure(source: SourceModel, now: datetime) -> None:
+    """Schedules the next check of a source whose fetch failed, backing off exponentially.
+
+    :param source: The source that failed.
+    :param now: When the source was checked.
+    """
+
+    source.error_count += 1
+    source.next_check = now + backoff_interval(source.error_count)
+
+
+def schedule_not_modified(source: SourceModel, now: datetime) -> None:
+    """Schedules the next check of a source that hasn't changed, keeping its current interval.
+
+    :param source: The source that was checked.
+    :param now: When the source was checked.
+    """
+
+    source.error_count = 0
+    source.next_check = now + timedelta(seconds=source.poll_interval)
+
+
+def schedule_success(source: SourceModel, feed: FeedParserDict, now: datetime) -> None:
+    """Schedules the next check of a source that was fetched, from its publish rate and any hints in the feed.
+
+    Polls at twice the rate the feed publishes at. If that can't be worked out, the previous interval is stretched, so
+    dormant feeds drift towards the maximum interval.
+
+    :param source: The source that was fetched.
+    :param feed: The parsed feed.
+    :param now: When the source was checked.
+    """
+
+    previous: timedelta = timedelta(seconds=source.poll_interval)
+    observed: Optional[timedelta] = publish_interval(feed['entries'])
+    interval: timedelta = observed / 2 if observed is not None else previous * 2
+
+    # don't poll more often than the feed asks us to
+    hint: Optional[timedelta] = hinted_interval(feed.get('feed', {}))
+    if hint is not None:
+        interval = max(interval, hint)
+
+    interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+    source.error_count = 0
+    source.poll_interval = int(interval.total_seconds())
+    source.next_check = now + interval
@@ -0,0 +1,140 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from html import escape
+from pony.orm import (
+    Database,
+    db_session)
+from typing import (
+    Iterable,
+    List,
+    Tuple)
+
+
+# The search index is an FTS5 table of the plain text of each entry's title & summary, kept up to date by triggers, so
+# every insert, update and delete of an entry is reflected without the application having to do anything. The triggers
+# call plain_text, which storage registers on every connection. Markup isn't indexed, so it can't be matched, and it
+# can't turn up in snippets either.
+SEARCH_SETUP: List[str] = [
+    'CREATE VIRTUAL TABLE IF NOT EXISTS "entry_search" USING fts5(title, summary)',
+    '''CREATE TRIGGER IF NOT EXISTS "entry_search_insert" AFTER INSERT ON "Entry" BEGIN
+        INSERT INTO "entry_search" (rowid, title, summary) VALUES (new.id, new.title, plain_text(new.summary));
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS "entry_search_delete" AFTER DELETE ON "Entry" BEGIN
+        DELETE FROM "entry_search" WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS "entry_search_update" AFTER UPDATE OF title, summary ON "Entry" BEGIN
+        UPDATE "entry_search" SET title = new.title, summary = plain_text(new.summary) WHERE rowid = new.id;
+    END'''
+]
+
+# Drops an index from before it held plain text, when it read the entries' HTML straight from the entry table.
+SEARCH_TEARDOWN: List[str] = [
+    'DROP TRIGGER IF EXISTS "entry_search_insert"',
+    'DROP TRIGGER IF EXISTS "entry_search_delete"',
+    'DROP TRIGGER IF EXISTS "entry_search_update"',
+    'DROP TABLE IF EXISTS "entry_search"'
+]
+
+# snippets mark matches with control characters, which XML doesn't allow in feeds, until the snippet's been escaped
+MATCH_END: str = '\x03'
+MATCH_START: str = '\x02'
+
+
+def build_match(query: str) -> str:
+    """Builds an FTS5 match expression from a user's search text. Each word is quoted, so the text can't be taken as
+    FTS5 query syntax, and an entry has to contain every word to match.
+
+    :param query: The search text.
+    :return: The match expression, empty if there were no words.
+    """
+
+    words: List[str] = query.split()
+    match: str = ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+    return match
+
+
+def highlight(snippet: str) -> str:
+    """Turns a snippet of plain text into HTML, with its matches marked. Only the match markers become tags, anything
+    else that looks like markup is escaped.
+
+    :param snippet: The snippet, with matches between MATCH_START and MATCH_END.
+    :return: The snippet's HTML.
+    """
+
+    html: str = escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+    return html
+
+
+def rebuild_search_index(db: Database) -> None:
+    """Rebuilds the search index from the entry table.
+
+    :param db: The bound database.
+    """
+
+    with db_session:
+        db.execute('DELETE FROM "entry_search"')
+        db.execute('''INSERT INTO "entry_search" (rowid, title, summary)
+            SELECT "id", "title", plain_text("summary") FROM "Entry"''')
+
+
+def search_entries(db: Database, query: str, source_ids: Iterable[int], limit: int,
+                   offset: int) -> List[Tuple[int, str]]:
+    """Searches the titles & summaries of entries from the given sources, best matches first. Must be called within a
+    database session.
+
+    :param db: The bound database.
+    :param query: The search text.
+    :param source_ids: IDs of the sources to search the entries of.
+    :param limit: The maximum number of results.
+    :param offset: The number of results to skip.
+    :return: The ID and a snippet of the matched text of each matching entry.
+    """
+
+    match: str = build_match(query)
+    sources: str = ', '.join(str(int(source_id)) for source_id in source_ids)
+    if not match or not sources:
+        return []
+
+    results: List[Tuple[int, str]] = db.select(f'''SELECT "entry_search".rowid,
+            snippet("entry_search", -1, $MATCH_START, $MATCH_END, '…', 16)
+        FROM "entry_search" JOIN "Entry" ON "Entry"."id" = "entry_search".rowid
+        WHERE "entry_search" MATCH $match AND "Entry"."source" IN ({sources})
+        ORDER BY rank
+        LIMIT $limit OFFSET $offset''')
+
+    snippets: List[Tuple[int, str]] = [(entry_id, highlight(snippet)) for entry_id, snippet in results]
+    return snippets
+
+
+def setup_search(db: Database) -> None:
+    """Creates the search index and the triggers that maintain it, if they don't already exist. A newly created index is
+    filled from the existing entries, as is one that replaces an index of the entries' HTML.
+
+    :param db: The bound database.
+    """
+
+    with db_session:
+        existing: List[str] = db.select('SELECT sql FROM sqlite_master WHERE name = \'entry_search\'')
+        outdated: bool = any('content=' in statement for statement in existing)
+        if outdated:
+            for statement in SEARCH_TEARDOWN:
+                db.execute(statement)
+
+        for statement in SEARCH_SETUP:
+            db.execute(statement)
+
+    if outdated or not existing:
+        rebuild_search_index(db)
@@ -16,18 +16,182 @@
 (function() {
 
 /**
- * Downloads entries from REST API, then renders them to the given element.
+ * Cursor for the next page of entries. Null when there are no more pages.
+ */
+let nextCursor = null;
+
+/**
+ * ID of the latest entry the server had when entries were last downloaded. Null before the first download.
+ */
+let latestEntryId = null;
+
+/**
+ * Server-sent event source pushing new entries. Null until the first page of entries has been downloaded.
+ */
+let entryStream = null;
+
+/**
+ * Whether a page of entries is currently being downloaded.
+ */
+let loadingEntries = false;
+
+/**
+ * Compiled Handlebars templates, by template ID.
+ */
+let templates = {};
+
+/**
+ * Gets a compiled Handlebars template, compiling it the first time it's asked for.
+ *
+ * @param {string} templateId The ID of the Handlebars template.
+ * @returns {function} The compiled template.
+ */
+function getTemplate(templateId) {
+    if (!(templateId in templates)) {
+        let source = $(templateId).html();
+        templates[templateId] = Handlebars.compile(source);
+    }
+
+    return templates[templateId];
+}
+
+/**
+ * Downloads a page of entries from REST API, then renders them to the given element.
  *
  * @param {string} feedsUrl The REST URL to download the feeds from.
+ * @param {?string} cursor The cursor of the page to download, null for the first page.
  * @param {string} templateId The ID of the Handlebars template to use for the render.
  * @param {string} destinationId The ID of the destination element to render the feed template to.
  */
-function refreshEntries(feedsUrl, templateId, destinationId) {
-    $.get(feedsUrl, function(data, status) {
-        let source = $(templateId).html();
-        let template = Handlebars.compile(source);
+function loadEntries(feedsUrl, cursor, templateId, destinationId) {
+    let params = cursor === null ? {} : {cursor: cursor};
+
+    loadingEntries = true;
+    $('#entries-spinner').removeClass('d-none');
+    $('#entriesMore').addClass('d-none');
+
+    $.get(feedsUrl, params, function(data, status) {
+        let template = getTemplate(templateId);
         let html = template(data);
-        $(destinationId).html(html);
+        if (cursor === null) {
+            $(destinationId).html(html);
+            latestEntryId = data.latest;
+            listenForEntries('/entries/stream', feedsUrl, templateId, destinationId);
+        } else {
+            $(destinationId).append(html);
+        }
+
+        nextCursor = data.next;
+        $('#entriesMore').toggleClass('d-none', nextCursor === null);
+    }).always(function() {
+        loadingEntries = false;
+        $('#entries-spinner').addClass('d-none');
+    });
+}
+
+/**
+ * Downloads the first page of entries from REST API, replacing the rendered entries.
+ *
+ * @param {string} feedsUrl The REST URL to download the feeds from.
+ * @param {string} templateId The ID of the Handlebars template to use for the render.
+ * @param {string} destinationId The ID of the destination element to render the feed template to.
+ */
+function refreshEntries(feedsUrl, templateId, destinationId) {
+    loadEntries(feedsUrl, null, templateId, destinationId);
+}
+
+/**
+ * Downloads the next page of entries, if there is one and one isn't already downloading.
+ */
+function loadMoreEntries() {
+    if (loadingEntries || nextCursor === null) {
+        return;
+    }
+
+    loadEntries('/entries', nextCursor, '#entries-template', '#entries-rows');
+}
+
+/**
+ * Click event handler for entriesMore button.
+ *
+ * @param {Event} event The jQuery event. Currently unused.
+ */
+function entriesMore_click(event) {
+    loadMoreEntries();
+}
+
+/**
+ * Downloads the entries added since the last download, and adds them to the top of the rendered entries. Falls back to
+ * a full refresh if nothing has been downloaded yet, or if there are more new entries than fit in one page.
+ *
+ * @param {string} feedsUrl The REST URL to download the feeds from.
+ * @param {string} templateId The ID of the Handlebars template to use for the render.
+ * @param {string} destinationId The ID of the destination element to render the feed template to.
+ */
+function mergeNewEntries(feedsUrl, templateId, destinationId) {
+    if (latestEntryId === null) {
+        refreshEntries(feedsUrl, templateId, destinationId);
+        return;
+    }
+
+    $.get(feedsUrl, {since: latestEntryId}, function(data, status) {
+        if (data.next !== null) {
+            refreshEntries(feedsUrl, templateId, destinationId);
+            return;
+        }
+
+        prependNewEntries(data, templateId, destinationId);
+    });
+}
+
+/**
+ * Adds new entries to the top of the rendered entries, skipping any that are already there. Entries are merged both by
+ * manual refreshes and by the entry stream, each of which can overlap the other.
+ *
+ * @param {Object} data A page of entries added since the last download, as sent by the REST API.
+ * @param {string} templateId The ID of the Handlebars template to use for the render.
+ * @param {string} destinationId The ID of the destination element to render the feed template to.
+ */
+function prependNewEntries(data, templateId, destinationId) {
+    let merged = latestEntryId;
+    let entries = data.entries.filter(function(entry) {
+        return entry.id > merged;
+    });
+
+    latestEntryId = Math.max(latestEntryId, data.latest);
+    if (entries.length === 0) {
+        return;
+    }
+
+    let template = getTemplate(templateId);
+    let html = template($.extend({}, data, {entries: entries}));
+    $(destinationId).prepend(html);
+}
+
+/**
+ * Starts listening for entries pushed by the server as they're stored, adding them to the top of the rendered entries.
+ * Reloads the entries instead when the server says there are too many new ones to push. Does nothing if already
+ * listening.
+ *
+ * @param {string} streamUrl The URL of the server-sent entry stream.
+ * @param {string} feedsUrl The REST URL to reload the feeds from.
+ * @param {string} templateId The ID of the Handlebars template to use for the render.
+ * @param {string} destinationId The ID of the destination element to render the feed template to.
+ */
+function listenForEntries(streamUrl, feedsUrl, templateId, destinationId) {
+    if (entryStream !== null || typeof EventSource === 'undefined') {
+        return;
+    }
+
+    entryStream = new EventSource(streamUrl + '?since=' + latestEntryId);
+    entryStream.addEventListener('entries', function(event) {
+        prependNewEntries(JSON.parse(event.data), templateId, destinationId);
+    });
+    entryStream.addEventListener('reload', function(event) {
+        let data = JSON.parse(event.data);
+        if (data.latest > latestEntryId) {
+            refreshEntries(feedsUrl, templateId, destinationId);
+        }
     });
 }
 
@@ -37,18 +201,31 @@ function refreshEntries(feedsUrl, templateId, destinationId) {
  * @param {Event} event The jQuery event. Currently unused.
  */
 function feedRefresh_click(event) {
-    $('#entries-table').html('<div class="spinner-border"></div>');
-    refreshEntries('/entries', '#entries-template', '#entries-table');
+    mergeNewEntries('/entries', '#entries-template', '#entries-rows');
+}
+
+/**
+ * Scroll event handler for the window. Loads the next page of entries when nearing the bottom of the page.
+ *
+ * @param {Event} event The jQuery event. Currently unused.
+ */
+function window_scroll(event) {
+    let remaining = $(document).height() - $(window).scrollTop() - $(window).height();
+    if (remaining < $(window).height()) {
+        loadMoreEntries();
+    }
 }
 
 // perform logic that needs the DOM to have finished loading
 $(document).ready(function(){
     // attach logic to events
     $('#feedRefresh').click(feedRefresh_click);
+    $('#entriesMore').click(entriesMore_click);
+    $(window).scroll(window_scroll);
     $(document).on('show.bs.modal', '#addFeedModal', function () {console.log('showed addFeedModal')});
 
     // initial load of feed entries
-    refreshEntries('/entries', '#entries-template', '#entries-table');
+    refreshEntries('/entries', '#entries-template', '#entries-rows');
 });
 
 })();
@@ -0,0 +1,225 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from pony.orm import Database
+from sqlite3 import (
+    connect,
+    Connection)
+from typing import (
+    List,
+    Set,
+    Tuple)
+
+from excerpt import (
+    make_excerpt,
+    plain_text)
+
+
+# Columns added to tables since they were first created, as (table, column, definition). Pony stores empty optional
+# strings as '' rather than NULL, and SQLite can only add NOT NULL columns with a default, so every column has one.
+MIGRATION_COLUMNS: List[Tuple[str, str, str]] = [
+    ('Entry', 'content_hash', "VARCHAR(40) NOT NULL DEFAULT ''"),
+    ('Entry', 'excerpt', "TEXT NOT NULL DEFAULT ''"),
+    ('Entry', 'guid', "TEXT NOT NULL DEFAULT ''"),
+    ('Job', 'heartbeat', 'DATETIME'),
+    ('Source', 'error_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('Source', 'etag', "TEXT NOT NULL DEFAULT ''"),
+    ('Source', 'lease_owner', "TEXT NOT NULL DEFAULT ''"),
+    ('Source', 'lease_until', 'DATETIME'),
+    ('Source', 'modified', "TEXT NOT NULL DEFAULT ''"),
+    ('Source', 'next_check', "DATETIME NOT NULL DEFAULT '0001-01-01 00:00:00.000000'"),
+    ('Source', 'poll_interval', 'INTEGER NOT NULL DEFAULT 3600'),
+    ('Source', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('User', 'version', 'INTEGER NOT NULL DEFAULT 0')
+]
+
+# Entries were keyed on (source, link, title, updated), by a constraint SQLite can't drop, so a table that still has it
+# is rebuilt keyed on (source, guid). The link stands in for the guid, and only the newest of the entries that were
+# stored again when they were edited is kept. Entry IDs, and the last one handed out, are kept as they were. Entries
+# get their excerpts, and a content hash no content has, so they're brought up to date the next time they're fetched.
+ENTRY_OLD_KEY: str = 'unq_entry__source_link_title_updated'
+ENTRY_REBUILD: List[str] = [
+    """UPDATE "Entry" SET "content_hash" = 'migrated', "excerpt" = make_excerpt("summary"), "guid" = "link"
+        WHERE "guid" = ''""",
+    'DELETE FROM "Entry" WHERE "id" NOT IN (SELECT max("id") FROM "Entry" GROUP BY "source", "guid")',
+    '''CREATE TABLE "Entry_rebuilt" (
+  "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+  "content_hash" VARCHAR(40) NOT NULL,
+  "excerpt" TEXT NOT NULL,
+  "guid" TEXT NOT NULL,
+  "link" TEXT NOT NULL,
+  "source" INTEGER NOT NULL REFERENCES "Source" ("id") ON DELETE CASCADE,
+  "summary" TEXT NOT NULL,
+  "title" TEXT NOT NULL,
+  "updated" DATETIME NOT NULL,
+  CONSTRAINT "unq_entry__source_guid" UNIQUE ("source", "guid")
+)''',
+    '''INSERT INTO "Entry_rebuilt"
+            ("id", "content_hash", "excerpt", "guid", "link", "source", "summary", "title", "updated")
+        SELECT "id", "content_hash", "excerpt", "guid", "link", "source", "summary", "title", "updated"
+        FROM "Entry"''',
+    """UPDATE "sqlite_sequence" SET "seq" = (SELECT "seq" FROM "sqlite_sequence" WHERE "name" = 'Entry')
+        WHERE "name" = 'Entry_rebuilt'""",
+    'DROP TABLE "Entry"',
+    'ALTER TABLE "Entry_rebuilt" RENAME TO "Entry"'
+]
+
+# Indexes added since tables were first created, as (table, index, columns), named the way Pony names them when it
+# creates the tables.
+MIGRATION_INDEXES: List[Tuple[str, str, str]] = [
+    ('Entry', 'idx_entry__content_hash', '"content_hash"'),
+    ('Entry', 'idx_entry__source_updated', '"source", "updated"'),
+    ('Entry', 'idx_entry__updated', '"updated"'),
+    ('Source', 'idx_source__next_check', '"next_check"'),
+    ('SourceUserData', 'idx_sourceuserdata__user_source', '"user", "source"')
+]
+
+# Older versions had Pony create the tables before migrating them, so Pony made the indexes of columns that hadn't been
+# added yet. SQLite took the column names for strings, and indexed every row under a constant, so the indexes that were
+# made that way are dropped before the columns are added. Any indexes that were already out of step with their rows are
+# rebuilt, once; the database's user_version records that it's been done.
+SCHEMA_VERSION: int = 1
+
+
+def apply_pragmas(connection: Connection, pragmas: dict) -> None:
+    """Applies SQLite pragmas to a connection.
+
+    :param connection: The SQLite connection.
+    :param pragmas: The pragma values, keyed by pragma name.
+    """
+
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_storage(db: Database, pragmas: dict) -> None:
+    """Sets up every SQLite connection the database opens with the given pragmas, and the functions the search index's
+    triggers call. Must be called before the database is bound, so the first connection gets them too.
+
+    :param db: The database.
+    :param pragmas: The pragma values, keyed by pragma name.
+    """
+
+    @db.on_connect(provider='sqlite')
+    def on_connect(_: Database, connection: Connection) -> None:
+        apply_pragmas(connection, pragmas)
+        register_functions(connection)
+
+
+def maintain_storage(db: Database, pragmas: dict, vacuum: bool) -> None:
+    """Performs periodic maintenance on an SQLite database: checkpoints and truncates the write-ahead log, refreshes the
+    query planner's statistics, and optionally rebuilds the database file to reclaim free space.
+
+    Uses a connection of its own, since VACUUM can't run inside the transactions Pony opens.
+
+    :param db: The bound database.
+    :param pragmas: The pragma values to set up the connection with, keyed by pragma name.
+    :param vacuum: Whether to rebuild the database file.
+    """
+
+    connection: Connection = connect(db.provider.pool.filename, isolation_level=None)
+    try:
+        apply_pragmas(connection, pragmas)
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.execute('ANALYZE')
+        if vacuum:
+            connection.execute('VACUUM')
+    finally:
+        connection.close()
+
+
+def migrate_storage(db: Database, pragmas: dict) -> None:
+    """Brings the tables of an existing SQLite database up to date, adding the columns and indexes that Pony won't add
+    to tables that already exist. Must be run before the database is mapped, so Pony finds the tables up to date. Safe
+    to run more than once, and quick when there's nothing to do.
+
+    Tables that don't exist yet are left for Pony to create.
+
+    :param db: The bound database.
+    :param pragmas: The pragma values to set up the connection with, keyed by pragma name.
+    """
+
+    filename: str = db.provider.pool.filename
+    if filename == ':memory:':
+        return
+
+    connection: Connection = connect(filename, isolation_level=None)
+    try:
+        apply_pragmas(connection, pragmas)
+        register_functions(connection)
+        connection.execute('BEGIN IMMEDIATE')
+        changed: bool = False
+
+        # drop the indexes of constants, rather than of columns
+        indexes: List[str] = [row[0] for row in connection.execute(
+            'SELECT name FROM sqlite_master WHERE type = \'index\' AND sql IS NOT NULL')]
+        for index in indexes:
+            if any(row[1] == -2 for row in connection.execute(f'PRAGMA index_xinfo("{index}")')):
+                connection.execute(f'DROP INDEX "{index}"')
+                changed = True
+
+        # add missing columns
+        tables: Set[str] = {row[0] for row in connection.execute(
+            'SELECT name FROM sqlite_master WHERE type = \'table\'')}
+        for table, column, definition in MIGRATION_COLUMNS:
+            columns: Set[str] = {row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')}
+            if table in tables and column not in columns:
+                connection.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}')
+                changed = True
+
+        # re-key the entries
+        entry_table: List[str] = [row[0] for row in connection.execute(
+            'SELECT sql FROM sqlite_master WHERE type = \'table\' AND name = \'Entry\'')]
+        if any(ENTRY_OLD_KEY in sql for sql in entry_table):
+            for statement in ENTRY_REBUILD:
+                connection.execute(statement)
+            changed = True
+
+        # rebuild the indexes that may be out of step with their rows
+        indexes = [row[0] for row in connection.execute('SELECT name FROM sqlite_master WHERE type = \'index\'')]
+        if connection.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            for _, index, _ in MIGRATION_INDEXES:
+                if index in indexes:
+                    connection.execute(f'REINDEX "{index}"')
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        # add missing indexes
+        for table, index, columns in MIGRATION_INDEXES:
+            if table in tables and index not in indexes:
+                connection.execute(f'CREATE INDEX "{index}" ON "{table}" ({columns})')
+                changed = True
+
+        connection.execute('COMMIT')
+
+        # let the query planner know about the new indexes
+        if changed:
+            connection.execute('ANALYZE')
+    except Exception:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+
+def register_functions(connection: Connection) -> None:
+    """Registers the application's SQL functions on a connection.
+
+    :param connection: The SQLite connection.
+    """
+
+    connection.create_function('make_excerpt', 1, make_excerpt)
+    connection.create_function('plain_text', 1, plain_text)
@@ -0,0 +1,131 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple)
+
+from support import (
+    bind_database,
+    run_in_process)
+
+
+# The size of a 10,000 entry timeline in each of the encodings /entries can respond with, and how long it takes to
+# serialize in each, the way the responses are. Brotli and MessagePack are only measured if they're installed. Not
+# collected with the tests; run it with `python -m pytest tests/benchmark_encodings.py -s`.
+ENTRY_COUNT: int = 10000
+ROUNDS: int = 3
+SOURCE_COUNT: int = 50
+SUMMARY: str = ('<p>Entry {entry} of source {source}\'s summary runs to a paragraph or two of text, with <a '
+                'href="http://example.com/{source}/{entry}">links</a> and <em>some</em> other markup, of which its '
+                'excerpt keeps the first couple of hundred characters as plain text.</p><p>The rest of it is only '
+                'sent when the entry is opened.</p>')
+TAG_COUNT: int = 3
+
+
+def time_encodings(path: str) -> Dict[str, Tuple[int, float]]:
+    """Builds a timeline in a new database, then serializes a page of all of it in each encoding, best of a few rounds.
+
+    :return: The size in bytes of each encoding, and the seconds it took to serialize, keyed by encoding.
+    """
+
+    from compression import (
+        brotli,
+        compress_body,
+        compress_chunks)
+    from database import (
+        Entry as EntryModel,
+        SourceUserData as SourceUserDataModel,
+        Tag as TagModel,
+        User as UserModel)
+    from datetime import (
+        datetime,
+        timedelta)
+    from excerpt import make_excerpt
+    from feeds import build_source
+    from flask import Flask
+    from pony.orm import db_session
+    from representations import (
+        buffer_chunks,
+        encode_body,
+        iter_json,
+        msgpack)
+    from rest import get_entries_page
+    from time import perf_counter
+
+    bind_database(path, True)
+    with db_session:
+        user: UserModel = UserModel.build('user', 'password')
+        tags: List[TagModel] = [TagModel(label=f'Tag {number}', user=user) for number in range(TAG_COUNT)]
+        for number in range(SOURCE_COUNT):
+            source = build_source(f'http://example.com/{number}/feed', {})
+            SourceUserDataModel(source=source, tags=tags[:number % TAG_COUNT + 1], user=user)
+            for entry_number in range(ENTRY_COUNT // SOURCE_COUNT):
+                link: str = f'http://example.com/{number}/{entry_number}'
+                summary: str = SUMMARY.format(entry=entry_number, source=number)
+                EntryModel(content_hash='0' * 40, excerpt=make_excerpt(summary), guid=link, link=link, source=source,
+                           summary=summary, title=f'Entry {entry_number} of source {number}',
+                           updated=datetime(2019, 1, 1) + timedelta(hours=entry_number, minutes=number))
+
+        user_id = user.user_id
+
+    app: Flask = Flask(__name__)
+    app.config.update(COMPRESSION_MIN_SIZE=1024, MATERIALIZED_TIMELINE=False)
+    with app.app_context():
+        page: dict = get_entries_page(user_id, None, None, ENTRY_COUNT)
+        entries: list = list(page['entries'])
+        next_cursor, latest = page['next'](), page['latest']()
+
+        def data() -> dict:
+            return {'entries': (entry for entry in entries), 'next': next_cursor, 'latest': latest}
+
+        # JSON is streamed, and compressed as it is; MessagePack is encoded, then compressed, in one go
+        compressions: List[str] = ['gzip', 'br'] if brotli is not None else ['gzip']
+        serializers: Dict[str, Callable[[], bytes]] = {'json': lambda: b''.join(chunk.encode('utf-8')
+                                                                     for chunk in buffer_chunks(iter_json(data())))}
+        for encoding in compressions:
+            serializers[f'json, {encoding}'] = \
+                lambda encoding=encoding: b''.join(compress_chunks(buffer_chunks(iter_json(data())), encoding, 'utf-8'))
+        if msgpack is not None:
+            serializers['msgpack'] = lambda: encode_body(data(), 'application/msgpack')
+            for encoding in compressions:
+                serializers[f'msgpack, {encoding}'] = \
+                    lambda encoding=encoding: compress_body(encode_body(data(), 'application/msgpack'), encoding)[0]
+
+        timings: Dict[str, Tuple[int, float]] = {}
+        for name, serialize in serializers.items():
+            laps: List[float] = []
+            for _ in range(ROUNDS):
+                started: float = perf_counter()
+                body: bytes = serialize()
+                laps.append(perf_counter() - started)
+
+            timings[name] = (len(body), min(laps))
+
+    return timings
+
+
+def test_encoding_sizes_and_times(tmp_path: Path) -> None:
+    timings: Dict[str, Tuple[int, float]] = run_in_process(time_encodings, str(tmp_path / 'feeds.sqlite'))
+
+    print(f'\nA page of {ENTRY_COUNT} timeline entries:')
+    print(f'{"":16}{"bytes":>12}{"ms":>10}')
+    for name, (size, seconds) in timings.items():
+        print(f'{name:16}{size:12}{seconds * 1000:10.1f}')
+
+    assert timings['json, gzip'][0] < timings['json'][0]
@@ -0,0 +1,131 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple)
+
+from support import (
+    bind_database,
+    run_in_process)
+
+
+# How fast process_entries stores a large synthetic feed, new and then unchanged, against looking each entry up with a
+# query of its own, the way it used to. Not collected with the tests; run it with
+# `python -m pytest tests/benchmark_entries.py -s`.
+FEED_SIZE: int = 1000
+ROUNDS: int = 3
+
+
+def synthetic_feed(size: int) -> list:
+    """Builds the entries of a feed the way feedparser would parse them."""
+
+    from feedparser import FeedParserDict
+    from time import gmtime
+
+    entries: list = [FeedParserDict(id=f'tag:example.com,2019:{number}', link=f'http://example.com/{number}',
+                                    summary=f'<p>Summary of entry {number}, with <b>some</b> markup.</p>',
+                                    title=f'Entry {number}', updated_parsed=gmtime(1546300800 + number * 60))
+                     for number in range(size)]
+    return entries
+
+
+def store_one_at_a_time(entries: list, source) -> None:
+    """Stores the new entries of a feed, looking each one up with a query of its own, as process_entries used to."""
+
+    from database import Entry as EntryModel
+    from excerpt import make_excerpt
+    from feeds import (
+        hash_entry,
+        utc_timestamp_from_struct_time)
+
+    for entry in entries:
+        link: str = entry['link']
+        guid: str = entry.get('id') or link
+        title: str = entry.get('title') or link
+        summary: str = entry.get('summary', '')
+        updated = utc_timestamp_from_struct_time(entry.get('updated_parsed'))
+        if EntryModel.get(source=source, guid=guid) is not None:
+            continue
+
+        EntryModel(content_hash=hash_entry(link, title, updated, summary), excerpt=make_excerpt(summary), guid=guid,
+                   link=link, source=source, summary=summary, title=title, updated=updated)
+
+
+def time_stores(path: str) -> Dict[str, Tuple[float, float]]:
+    """Times each way of storing the synthetic feed into a new source, then storing it again unchanged, best of a few
+    rounds.
+
+    :return: The seconds each took, new and unchanged, keyed by how the entries were stored.
+    """
+
+    from database import Source as SourceModel
+    from feeds import (
+        build_source,
+        process_entries)
+    from flask import Flask
+    from pony.orm import db_session
+    from time import perf_counter
+
+    bind_database(path, True)
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    entries: list = synthetic_feed(FEED_SIZE)
+    seen: Dict[int, Dict[str, str]] = {}
+
+    def remember(feed_entries: list, source: SourceModel) -> None:
+        seen[source.id] = process_entries(feed_entries, source, seen)
+
+    ways: Dict[str, Callable[[list, SourceModel], None]] = {
+        'a query per entry': store_one_at_a_time,
+        'a query per feed': process_entries,
+        'a query per feed, remembered': remember
+    }
+
+    timings: Dict[str, Tuple[float, float]] = {}
+    with app.app_context():
+        for round_number in range(ROUNDS):
+            for way, store in ways.items():
+                with db_session:
+                    source: SourceModel = build_source(f'http://example.com/{way}/{round_number}', {})
+                    source.flush()
+                    source_id: int = source.id
+
+                # storing the feed's entries the first time, then again, unchanged
+                laps: List[float] = []
+                for _ in range(2):
+                    started: float = perf_counter()
+                    with db_session:
+                        store(entries, SourceModel[source_id])
+                    laps.append(perf_counter() - started)
+
+                best: Tuple[float, float] = timings.get(way, (float('inf'), float('inf')))
+                timings[way] = (min(best[0], laps[0]), min(best[1], laps[1]))
+
+    return timings
+
+
+def test_process_entries_throughput(tmp_path: Path) -> None:
+    timings: Dict[str, Tuple[float, float]] = run_in_process(time_stores, str(tmp_path / 'feeds.sqlite'))
+
+    print(f'\nEntries stored per second, from a feed of {FEED_SIZE}:')
+    print(f'{"":32}{"new":>12}{"unchanged":>12}')
+    for way, (new, unchanged) in timings.items():
+        print(f'{way:32}{FEED_SIZE / new:12.0f}{FEED_SIZE / unchanged:12.0f}')
+
+    assert timings['a query per feed'][1] < timings['a query per entry'][1]
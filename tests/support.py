@@ -0,0 +1,67 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
+from queue import Empty
+from typing import (
+    Any,
+    Callable)
+
+
+# Pony binds the models to one database per process, so tests that need a database of their own run in a process of
+# their own too.
+PRAGMAS: dict = {'journal_mode': 'wal', 'busy_timeout': 30000}
+
+
+def bind_database(path: str, create_tables: bool, pragmas: dict = PRAGMAS) -> None:
+    """Binds the database to a file, the way main does, with the given SQLite pragmas."""
+
+    from database import db
+    from storage import configure_storage
+
+    configure_storage(db, pragmas)
+    db.bind(provider='sqlite', filename=path, create_db=create_tables)
+    db.generate_mapping(check_tables=False, create_tables=create_tables)
+
+
+def call(results, target: Callable[..., Any], args: tuple) -> None:
+    """Calls a function, passing its result back to the parent process."""
+
+    results.put(target(*args))
+
+
+def run_in_process(target: Callable[..., Any], *args) -> Any:
+    """Runs a module level function in a process of its own, returning its result, which must be picklable."""
+
+    context: BaseContext = get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=call, args=(results, target, args))
+    process.start()
+
+    # the result's read before the process is joined, so a large one isn't left stuck in the queue's pipe; a process
+    # that dies without one is noticed, rather than waited on forever
+    received: list = []
+    while not received:
+        alive: bool = process.is_alive()
+        try:
+            received.append(results.get(timeout=0.1))
+        except Empty:
+            if not alive:
+                break
+
+    process.join()
+    assert process.exitcode == 0
+    return received[0]
@@ -0,0 +1,203 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import Counter
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer)
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from statistics import median
+from threading import (
+    Lock,
+    Thread)
+from time import (
+    monotonic,
+    sleep)
+from typing import (
+    Iterator,
+    List,
+    Optional)
+from uuid import UUID
+
+import pytest
+
+from defaultconfig import SQLITE_PRAGMAS
+from support import (
+    bind_database,
+    call,
+    run_in_process)
+
+
+# An updater stores feeds of many entries, fetched from a local stand-in for the feeds' hosts, while web readers, each
+# in a process of their own, keep reading the first page of a timeline, with the pragmas the app ships with. The read
+# latency is compared with that of the same timeline while nothing's writing.
+ENTRIES_PER_FEED: int = 100
+FEED_COUNT: int = 40
+FEED_DELAY: float = 0.05  # seconds
+IDLE_READS: int = 50
+READERS: int = 2
+SLOWEST_READ: float = 1.0  # seconds, that a read may take while the updater's writing
+
+ITEM_TEMPLATE: str = ('<item><title>Entry {number}</title><link>http://example.com{path}/{number}</link>'
+                      '<description>Entry {number} of {path}, with a short summary.</description></item>')
+FEED_TEMPLATE: str = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Feed {path}</title>'
+                      '<link>http://example.com{path}</link>{items}</channel></rss>')
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves a feed of many entries at any path, all of them new each time it's fetched, taking a while to answer,
+    like a real host would."""
+
+    fetches: Counter = Counter()
+    lock: Lock = Lock()
+
+    def do_GET(self) -> None:
+        with self.lock:
+            first: int = self.fetches[self.path] * ENTRIES_PER_FEED
+            self.fetches[self.path] += 1
+
+        sleep(FEED_DELAY)
+        items: str = ''.join(ITEM_TEMPLATE.format(number=number, path=self.path)
+                             for number in range(first, first + ENTRIES_PER_FEED))
+        body: bytes = FEED_TEMPLATE.format(items=items, path=self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def add_subscriptions(path: str, uris: List[str]) -> UUID:
+    """Creates the database, with a user subscribed to a source for each URI.
+
+    :return: The ID of the user.
+    """
+
+    from database import (
+        SourceUserData as SourceUserDataModel,
+        User as UserModel)
+    from feeds import build_source
+    from pony.orm import db_session
+
+    bind_database(path, True, SQLITE_PRAGMAS)
+    with db_session:
+        user: UserModel = UserModel.build('user', 'password')
+        for uri in uris:
+            SourceUserDataModel(source=build_source(uri, {}), user=user)
+
+        return user.user_id
+
+
+def read_timeline(path: str, user_id: UUID, writing=None) -> List[float]:
+    """Reads the first page of the user's timeline over and over, the way the web app does, timing each read.
+
+    :param writing: Read for as long as this event is set, None to read IDLE_READS times.
+    :return: How long each read took, in seconds.
+    """
+
+    from flask import Flask
+    from rest import (
+        DEFAULT_PAGE_SIZE,
+        get_entries_page)
+
+    bind_database(path, False, SQLITE_PRAGMAS)
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    latencies: List[float] = []
+    with app.app_context():
+        while writing.is_set() if writing is not None else len(latencies) < IDLE_READS:
+            started: float = monotonic()
+            list(get_entries_page(user_id, None, None, DEFAULT_PAGE_SIZE)['entries'])
+            latencies.append(monotonic() - started)
+
+    return latencies
+
+
+def run_updater(path: str) -> Counter:
+    """Runs an update of every source against the database, the way `flask up --all` does."""
+
+    from feeds import update_feeds
+    from flask import Flask
+
+    bind_database(path, False, SQLITE_PRAGMAS)
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    with app.app_context():
+        stats: Counter = update_feeds(everything=True)
+
+    return stats
+
+
+def describe(latencies: List[float]) -> str:
+    """Summarizes read latencies in milliseconds."""
+
+    ordered: List[float] = sorted(latencies)
+    percentile: float = ordered[int(len(ordered) * 0.95)]
+    summary: str = (f'{len(ordered)} reads, median {median(ordered) * 1000:.1f} ms, 95th percentile '
+                    f'{percentile * 1000:.1f} ms, slowest {ordered[-1] * 1000:.1f} ms')
+    return summary
+
+
+@pytest.fixture
+def feed_uris() -> Iterator[List[str]]:
+    """Starts the stand-in feed server, yielding the URIs of the feeds it serves."""
+
+    FeedHandler.fetches.clear()
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield [f'http://127.0.0.1:{server.server_port}/feed/{number}' for number in range(FEED_COUNT)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_reads_are_not_held_up_by_updates(feed_uris: List[str], tmp_path: Path) -> None:
+    path: str = str(tmp_path / 'feeds.sqlite')
+    user_id: UUID = run_in_process(add_subscriptions, path, feed_uris)
+    run_in_process(run_updater, path)
+    idle: List[float] = run_in_process(read_timeline, path, user_id)
+
+    # the readers keep going until the next update, of as many new entries again, is done
+    context: BaseContext = get_context('spawn')
+    writing = context.Event()
+    writing.set()
+    results = context.Queue()
+    readers: list = [context.Process(target=call, args=(results, read_timeline, (path, user_id, writing)))
+                     for _ in range(READERS)]
+    for reader in readers:
+        reader.start()
+
+    try:
+        stats: Counter = run_in_process(run_updater, path)
+    finally:
+        writing.clear()
+
+    reports: List[Optional[List[float]]] = [results.get(timeout=60) for _ in readers]
+    for reader in readers:
+        reader.join()
+        assert reader.exitcode == 0
+
+    loaded: List[float] = [latency for report in reports for latency in report]
+    print(f'\nRead latency while idle: {describe(idle)}')
+    print(f'Read latency while updating: {describe(loaded)}')
+
+    assert stats['fetched'] == FEED_COUNT
+    assert max(loaded) < SLOWEST_READ
@@ -0,0 +1,297 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import Counter
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    wait)
+from contextlib import contextmanager
+from datetime import datetime
+from feedparser import FeedParserDict
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer)
+from gzip import compress as gzip_compress
+from pathlib import Path
+from threading import Thread
+from time import (
+    monotonic,
+    sleep)
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Tuple)
+from uuid import UUID
+from zlib import compress as deflate_compress
+
+import pytest
+
+from feeds import (
+    download_feed,
+    FetchQueue)
+from support import (
+    bind_database,
+    run_in_process)
+
+
+FEED: str = ('<?xml version="1.0" encoding="utf-16"?><rss version="2.0"><channel><title>Wide</title>'
+             '<item><title>Entry</title><link>http://example.com/entry</link></item></channel></rss>')
+
+# bodies served by the stand-in feed server, keyed by path, and the encodings the compressed ones are served with
+BODIES: Dict[str, bytes] = {'/deflate': deflate_compress(FEED.encode('utf-16')),
+                            '/gzip': gzip_compress(FEED.encode('utf-16')),
+                            '/utf-16': FEED.encode('utf-16')}
+ENCODINGS: Dict[str, str] = {'/deflate': 'deflate', '/gzip': 'gzip'}
+
+# feeds from a host that takes a while to answer each, as many as to keep every fetching thread busy for a while
+SLOW_COUNT: int = 8
+SLOW_DELAY: float = 0.3  # seconds
+BODIES.update({f'/slow/{number}': FEED.encode('utf-16') for number in range(SLOW_COUNT)})
+
+# a feed sent a few bytes at a time, taking far longer than the deadline it's fetched with
+TRICKLE_DEADLINE: float = 0.5  # seconds
+TRICKLE_DELAY: float = 0.1  # seconds
+TRICKLE_SIZE: int = 8
+
+# a file of subscriptions to some of them, for an import
+IMPORT_COUNT: int = 5
+OPML_TEMPLATE: str = ('<?xml version="1.0"?><opml version="2.0"><body><outline text="Imported">{outlines}</outline>'
+                      '</body></opml>')
+OUTLINE_TEMPLATE: str = '<outline type="rss" text="Feed" xmlUrl="{uri}"/>'
+
+# feeds whose entry has an empty title, for an update in which one of them can't be stored
+UNTITLED_COUNT: int = 40
+UNTITLED_FEED: str = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Feed {number}</title>'
+                      '<item><title></title><link>http://example.com/{number}/entry</link></item></channel></rss>')
+BODIES.update({f'/untitled/{number}': UNTITLED_FEED.format(number=number).encode('utf-8')
+               for number in range(UNTITLED_COUNT)})
+
+
+class BodyHandler(BaseHTTPRequestHandler):
+    """Serves the body for the requested path, slowly for the slow ones."""
+
+    def do_GET(self) -> None:
+        if self.path == '/trickle':
+            self.trickle()
+            return
+
+        if self.path.startswith('/slow/'):
+            sleep(SLOW_DELAY)
+
+        body: bytes = BODIES[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path in ENCODINGS:
+            self.send_header('Content-Encoding', ENCODINGS[self.path])
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def trickle(self) -> None:
+        """Sends a feed a few bytes at a time, each soon enough after the last that no read times out."""
+
+        body: bytes = FEED.encode('utf-16')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            for start in range(0, len(body), TRICKLE_SIZE):
+                self.wfile.write(body[start:start + TRICKLE_SIZE])
+                self.wfile.flush()
+                sleep(TRICKLE_DELAY)
+        except OSError:  # the client's given up
+            pass
+
+
+def import_subscriptions(path: str, uris: List[str]) -> Tuple[str, List[Tuple[str, int]]]:
+    """Imports an OPML file of subscriptions to the given feeds into a new database, running the import's job.
+
+    :return: The status of the job, and the URI and entry count of each source.
+    """
+
+    from database import (
+        Job as JobModel,
+        Source as SourceModel,
+        User as UserModel)
+    from flask import Flask
+    from io import BytesIO
+    from jobs import run_worker
+    from opml import import_opml
+    from pony.orm import (
+        count,
+        db_session,
+        select)
+
+    bind_database(path, True)
+    with db_session:
+        user_id: UUID = UserModel.build('user', 'password').user_id
+
+    opml: str = OPML_TEMPLATE.format(outlines=''.join(OUTLINE_TEMPLATE.format(uri=uri) for uri in uris))
+    job_id: int = import_opml(BytesIO(opml.encode('utf-8')), user_id)
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    with app.app_context():
+        run_worker(drain=True)
+
+    with db_session:
+        status: str = JobModel[job_id].status
+        sources: List[Tuple[str, int]] = select((s.feed_uri, count(s.entries)) for s in SourceModel)[:]
+
+    return status, sorted(sources)
+
+
+def update_with_a_failure(path: str, uris: List[str], failing_uri: str) -> Tuple[Counter, List[Tuple[str, str]], bool]:
+    """Updates a new database of sources for the given feeds, with the entries of one of them failing to store.
+
+    :return: The update's counts, the titles and links of the entries stored, and whether the failing source was
+        scheduled as a failed fetch.
+    """
+
+    import feeds
+    from database import (
+        Entry as EntryModel,
+        Source as SourceModel)
+    from flask import Flask
+    from pony.orm import (
+        db_session,
+        select)
+
+    bind_database(path, True)
+    with db_session:
+        for uri in uris:
+            feeds.build_source(uri, {})
+
+    store_entries: Callable = feeds.process_entries
+
+    def process_entries(entries: list, source: SourceModel, seen: dict = None) -> dict:
+        if source.feed_uri == failing_uri:
+            raise ValueError('Entry can\'t be stored.')
+
+        return store_entries(entries, source, seen)
+
+    feeds.process_entries = process_entries
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    with app.app_context():
+        stats: Counter = feeds.update_feeds(batch_size=5)
+
+    with db_session:
+        stored: List[Tuple[str, str]] = select((e.title, e.link) for e in EntryModel)[:]
+        failing: SourceModel = SourceModel.get(feed_uri=failing_uri)
+        backed_off: bool = failing.error_count == 1 and failing.next_check > datetime.now()
+
+    return stats, stored, backed_off
+
+
+@contextmanager
+def serve_feeds() -> Iterator[Callable[[str], str]]:
+    """Starts a stand-in feed server, yielding a function that gives the URI of a path on it."""
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), BodyHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield lambda path: f'http://127.0.0.1:{server.server_port}{path}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def feed_uri() -> Iterator[Callable[[str], str]]:
+    """Starts the stand-in feed server, yielding a function that gives the URI of a path on it."""
+
+    with serve_feeds() as uri:
+        yield uri
+
+
+def test_feed_with_nul_bytes_is_parsed(feed_uri: Callable[[str], str]) -> None:
+    feed: FeedParserDict = download_feed(feed_uri('/utf-16'), '', '')
+    assert feed['feed']['title'] == 'Wide'
+    assert len(feed['entries']) == 1
+
+
+@pytest.mark.parametrize('path', ['/deflate', '/gzip'])
+def test_compressed_feed_is_decoded_once(feed_uri: Callable[[str], str], path: str) -> None:
+    feed: FeedParserDict = download_feed(feed_uri(path), '', '')
+    assert not feed['bozo']
+    assert feed['feed']['title'] == 'Wide'
+    assert len(feed['entries']) == 1
+    assert 'content-encoding' not in feed['headers']
+
+
+def test_body_is_not_taken_for_a_file_name(feed_uri: Callable[[str], str], tmp_path: Path) -> None:
+    local_feed: Path = tmp_path / 'feed.xml'
+    local_feed.write_text(FEED, encoding='utf-16')
+    BODIES['/path'] = str(local_feed).encode('utf-8')
+
+    feed: FeedParserDict = download_feed(feed_uri('/path'), '', '')
+    assert feed['bozo']
+    assert not feed['entries']
+
+
+def test_a_feed_that_cannot_be_stored_does_not_stop_the_update(feed_uri: Callable[[str], str], tmp_path: Path) -> None:
+    uris: List[str] = [feed_uri(f'/untitled/{number}') for number in range(UNTITLED_COUNT)]
+    stats, stored, backed_off = run_in_process(update_with_a_failure, str(tmp_path / 'feeds.sqlite'), uris, uris[7])
+
+    assert stats == Counter(fetched=UNTITLED_COUNT - 1, failed=1, not_modified=0)
+    assert backed_off
+
+    # entries without a title are titled with their link
+    assert len(stored) == UNTITLED_COUNT - 1
+    assert all(title == link for title, link in stored)
+
+
+def test_imported_feeds_are_ready_to_read(feed_uri: Callable[[str], str], tmp_path: Path) -> None:
+    uris: List[str] = sorted(feed_uri(f'/untitled/{number}') for number in range(IMPORT_COUNT))
+    status, sources = run_in_process(import_subscriptions, str(tmp_path / 'feeds.sqlite'), uris)
+
+    assert status == 'done'
+    assert sources == [(uri, 1) for uri in uris]
+
+
+def test_a_busy_host_does_not_hold_up_the_others(feed_uri: Callable[[str], str]) -> None:
+    with serve_feeds() as other_uri, ThreadPoolExecutor(max_workers=4) as executor:
+        fetches: FetchQueue = FetchQueue(executor, 1)
+        started: float = monotonic()
+        busy: List[Future] = [fetches.submit(feed_uri(f'/slow/{number}'), '', '') for number in range(SLOW_COUNT)]
+        other: List[Future] = [fetches.submit(other_uri('/utf-16'), '', '') for _ in range(3)]
+
+        wait(other)
+        other_finished: float = monotonic() - started
+        wait(busy)
+        busy_finished: float = monotonic() - started
+
+    # the other host's feeds don't wait for threads stuck on the busy host, which still only gets one fetch at a time
+    assert other_finished < SLOW_DELAY * 2
+    assert busy_finished >= SLOW_DELAY * SLOW_COUNT
+    assert not any(future.result()['bozo'] for future in busy + other)
+
+
+def test_a_trickled_feed_is_cut_off_at_the_deadline(feed_uri: Callable[[str], str],
+                                                    monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr('feeds.FETCH_DEADLINE', TRICKLE_DEADLINE)
+    started: float = monotonic()
+    feed: FeedParserDict = download_feed(feed_uri('/trickle'), '', '')
+
+    assert monotonic() - started < TRICKLE_DEADLINE * 2
+    assert feed['bozo']
+    assert 'longer than' in str(feed['bozo_exception'])
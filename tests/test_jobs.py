@@ -0,0 +1,65 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from pathlib import Path
+from typing import (
+    List,
+    Optional)
+
+from support import (
+    bind_database,
+    run_in_process)
+
+
+def claim_after_quiet_workers(path: str) -> List[Optional[int]]:
+    """Queues two jobs and claims both, as if by workers that have since gone, then has another worker claim a job,
+    once while they've been running for longer than the timeout but the first is still reporting progress, and once
+    after that too has gone quiet.
+
+    :return: The ID of each job the other worker claimed, None when it found nothing to claim.
+    """
+
+    from database import Job as JobModel
+    from datetime import datetime
+    from jobs import (
+        claim_job,
+        enqueue_job,
+        JOB_TIMEOUT,
+        report_progress)
+    from pony.orm import db_session
+
+    bind_database(path, True)
+    reporting: int = enqueue_job('test', {})
+    quiet: int = enqueue_job('test', {})
+    claim_job()
+    claim_job()
+    with db_session:
+        for job_id in (reporting, quiet):
+            JobModel[job_id].set(heartbeat=datetime.now() - JOB_TIMEOUT * 2, started=datetime.now() - JOB_TIMEOUT * 3)
+
+    # the job that's still being reported on is left with its worker, however long ago it started
+    report_progress(reporting, 1)
+    claims: list = [claim_job()]
+    with db_session:
+        JobModel[reporting].heartbeat = datetime.now() - JOB_TIMEOUT * 2
+    claims.extend([claim_job(), claim_job()])
+
+    return [claimed[0] if claimed is not None else None for claimed in claims]
+
+
+def test_only_jobs_gone_quiet_are_claimed_again(tmp_path: Path) -> None:
+    claims: List[Optional[int]] = run_in_process(claim_after_quiet_workers, str(tmp_path / 'jobs.sqlite'))
+
+    assert claims == [2, 1, None]
@@ -0,0 +1,158 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import Counter
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer)
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
+from pathlib import Path
+from threading import (
+    Lock,
+    Thread)
+from time import (
+    monotonic,
+    sleep)
+from typing import (
+    Iterator,
+    List,
+    Tuple)
+
+import pytest
+
+from support import (
+    bind_database,
+    run_in_process)
+
+
+# Several updaters, each in a process of its own, share a database of sources served by a local stand-in for the feeds'
+# hosts, which counts the requests it gets and takes a while to answer each, like a real host would.
+FEED_DELAY: float = 0.2  # seconds
+SOURCE_COUNT: int = 60
+UPDATERS: int = 3
+WORKERS: int = 4
+
+FEED_TEMPLATE: str = '''<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Feed {path}</title><link>http://example.com{path}</link>
+<item><title>Entry {path}</title><link>http://example.com{path}/entry</link><guid>{path}/entry</guid></item>
+</channel></rss>'''
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves a feed of one entry at any path, counting the requests for each path."""
+
+    counts: Counter = Counter()
+    lock: Lock = Lock()
+
+    def do_GET(self) -> None:
+        with self.lock:
+            self.counts[self.path] += 1
+
+        sleep(FEED_DELAY)
+        body: bytes = FEED_TEMPLATE.format(path=self.path).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def add_sources(path: str, uris: List[str]) -> None:
+    """Creates the database, with a source for each URI. Runs in a process of its own, as a database is bound once."""
+
+    from feeds import build_source
+    from pony.orm import db_session
+
+    bind_database(path, True)
+    with db_session:
+        for uri in uris:
+            build_source(uri, {})
+
+
+def run_updater(path: str, results) -> None:
+    """Runs an update against the shared database, reporting its counts and when it started and finished."""
+
+    from feeds import update_feeds
+    from flask import Flask
+
+    bind_database(path, False)
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    with app.app_context():
+        started: float = monotonic()
+        stats: Counter = update_feeds(workers=WORKERS, host_limit=WORKERS)
+        results.put((dict(stats), started, monotonic()))
+
+
+def run_updaters(path: str, uris: List[str], count: int) -> Tuple[Counter, float]:
+    """Runs updaters in parallel processes, over a new database of the given sources.
+
+    :return: The updaters' counts added together, and the time from the first starting to the last finishing.
+    """
+
+    run_in_process(add_sources, path, uris)
+
+    context: BaseContext = get_context('spawn')
+    results = context.Queue()
+    updaters: list = [context.Process(target=run_updater, args=(path, results)) for _ in range(count)]
+    for updater in updaters:
+        updater.start()
+
+    # the reports are small enough to sit in the queue until the updaters have finished
+    for updater in updaters:
+        updater.join()
+        assert updater.exitcode == 0
+
+    reports: list = [results.get() for _ in updaters]
+
+    stats: Counter = sum((Counter(report[0]) for report in reports), Counter())
+    elapsed: float = max(report[2] for report in reports) - min(report[1] for report in reports)
+    return stats, elapsed
+
+
+@pytest.fixture
+def feed_uris() -> Iterator[List[str]]:
+    """Starts the stand-in feed server, yielding the URIs of the feeds it serves."""
+
+    FeedHandler.counts.clear()
+    server: ThreadingHTTPServer = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield [f'http://127.0.0.1:{server.server_port}/feed/{number}' for number in range(SOURCE_COUNT)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_updaters_fetch_each_source_once(feed_uris: List[str], tmp_path: Path) -> None:
+    stats, _ = run_updaters(str(tmp_path / 'feeds.sqlite'), feed_uris, UPDATERS)
+
+    assert stats['fetched'] == SOURCE_COUNT
+    assert stats['failed'] == 0
+    assert len(FeedHandler.counts) == SOURCE_COUNT
+    assert set(FeedHandler.counts.values()) == {1}
+
+
+def test_updaters_share_the_work(feed_uris: List[str], tmp_path: Path) -> None:
+    _, alone = run_updaters(str(tmp_path / 'alone.sqlite'), feed_uris, 1)
+    FeedHandler.counts.clear()
+    _, shared = run_updaters(str(tmp_path / 'shared.sqlite'), feed_uris, UPDATERS)
+
+    # near-linear, allowing for the updaters not starting at quite the same time
+    assert shared < alone / (UPDATERS * 0.6)
@@ -0,0 +1,83 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import (
+    datetime,
+    timedelta)
+from pathlib import Path
+from typing import (
+    List,
+    Tuple)
+
+from support import (
+    bind_database,
+    run_in_process)
+
+
+# a user subscribed to sources with a few tags between them, and enough entries for the largest page
+ENTRIES_PER_SOURCE: int = 12
+PAGE_LIMITS: List[int] = [5, 100, 500]
+SOURCE_COUNT: int = 50
+TAG_COUNT: int = 3
+
+
+def count_page_queries(path: str) -> List[Tuple[int, int]]:
+    """Gets a page of each limit from a new database, counting the queries each takes.
+
+    :return: The number of entries in each page, with the number of queries it took.
+    """
+
+    from database import (
+        db,
+        Entry as EntryModel,
+        SourceUserData as SourceUserDataModel,
+        Tag as TagModel,
+        User as UserModel)
+    from feeds import build_source
+    from flask import Flask
+    from pony.orm import db_session
+    from rest import get_entries_page
+
+    bind_database(path, True)
+    with db_session:
+        user: UserModel = UserModel.build('user', 'password')
+        tags: List[TagModel] = [TagModel(label=f'Tag {number}', user=user) for number in range(TAG_COUNT)]
+        for number in range(SOURCE_COUNT):
+            source = build_source(f'http://example.com/{number}/feed', {})
+            SourceUserDataModel(source=source, tags=tags[:number % TAG_COUNT + 1], user=user)
+            for entry_number in range(ENTRIES_PER_SOURCE):
+                link: str = f'http://example.com/{number}/{entry_number}'
+                EntryModel(content_hash='0' * 40, guid=link, link=link, source=source, title=link,
+                           updated=datetime(2019, 1, 1) + timedelta(hours=entry_number, minutes=number))
+
+        user_id = user.user_id
+
+    app: Flask = Flask(__name__)
+    app.config['MATERIALIZED_TIMELINE'] = False
+    counts: List[Tuple[int, int]] = []
+    with app.app_context():
+        for limit in PAGE_LIMITS:
+            db.merge_local_stats()
+            entries: list = list(get_entries_page(user_id, None, None, limit)['entries'])
+            counts.append((len(entries), db.local_stats[None].db_count))
+
+    return counts
+
+
+def test_page_queries_do_not_grow_with_the_page(tmp_path: Path) -> None:
+    counts: List[Tuple[int, int]] = run_in_process(count_page_queries, str(tmp_path / 'feeds.sqlite'))
+
+    # the latest entry ID, the user, the entries, then the sources' display data and their tags
+    assert counts == [(limit, 5) for limit in PAGE_LIMITS]
@@ -0,0 +1,29 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from excerpt import plain_text
+from search import (
+    highlight,
+    MATCH_END,
+    MATCH_START)
+
+
+def test_markup_is_not_indexed() -> None:
+    assert plain_text('<p>Hello <script>alert(1)</script><b>world</b></p>') == 'Hello world'
+
+
+def test_snippets_only_mark_matches() -> None:
+    snippet: str = f'{MATCH_START}tags{MATCH_END} like <script> & such'
+    assert highlight(snippet) == '<mark>tags</mark> like &lt;script&gt; &amp; such'
@@ -0,0 +1,188 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime
+from pathlib import Path
+from pony.orm import db_session
+from sqlite3 import (
+    connect,
+    Connection)
+from typing import (
+    Iterator,
+    List)
+
+import pytest
+
+from database import (
+    db,
+    User as UserModel)
+from daemon import next_due
+from rest import (
+    select_materialized_timeline,
+    select_timeline)
+from search import setup_search
+from storage import (
+    configure_storage,
+    migrate_storage)
+
+
+PRAGMAS: dict = {'journal_mode': 'wal'}
+
+# the tables as the first version created them, with the indexes a later version's Pony made on columns that weren't
+# there yet, before the migration was run ahead of it
+OLD_SCHEMA: List[str] = [
+    '''CREATE TABLE "Source" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "feed_uri" TEXT UNIQUE NOT NULL,
+        "fetched_label" TEXT NOT NULL, "last_check" DATETIME NOT NULL, "last_fetch" DATETIME NOT NULL,
+        "link" TEXT NOT NULL)''',
+    '''CREATE TABLE "Entry" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "link" TEXT NOT NULL,
+        "source" INTEGER NOT NULL REFERENCES "Source" ("id") ON DELETE CASCADE, "summary" TEXT NOT NULL,
+        "title" TEXT NOT NULL, "updated" DATETIME NOT NULL,
+        CONSTRAINT "unq_entry__source_link_title_updated" UNIQUE ("source", "link", "title", "updated"))''',
+    '''CREATE TABLE "User" ("user_id" UUID NOT NULL PRIMARY KEY, "name" TEXT UNIQUE NOT NULL,
+        "password_hash" TEXT NOT NULL)''',
+    '''CREATE TABLE "SourceUserData" ("id" INTEGER PRIMARY KEY AUTOINCREMENT,
+        "source" INTEGER NOT NULL REFERENCES "Source" ("id") ON DELETE CASCADE,
+        "user" UUID NOT NULL REFERENCES "User" ("user_id") ON DELETE CASCADE, "user_label" TEXT NOT NULL,
+        CONSTRAINT "unq_sourceuserdata__source_user" UNIQUE ("source", "user"))''',
+    'CREATE INDEX "idx_sourceuserdata__user" ON "SourceUserData" ("user")',
+    'CREATE INDEX "idx_entry__content_hash" ON "Entry" ("content_hash")',
+    'CREATE INDEX "idx_source__next_check" ON "Source" ("next_check")'
+]
+
+OLD_DATA: List[str] = [
+    '''INSERT INTO "Source" VALUES (1, 'http://example.com/feed', 'Example', '2019-01-01 00:00:00.000000',
+        '2019-01-01 00:00:00.000000', 'http://example.com/')''',
+    "INSERT INTO \"User\" VALUES (X'00000000000000000000000000000001', 'user', 'hash')",
+    "INSERT INTO \"SourceUserData\" VALUES (1, 1, X'00000000000000000000000000000001', '')",
+    # the first entry was stored again when its title was edited
+    '''INSERT INTO "Entry" VALUES (1, 'http://example.com/1', 1, 'One', 'Entry one',
+        '2019-01-01 00:00:00.000000')''',
+    '''INSERT INTO "Entry" VALUES (2, 'http://example.com/2', 1, 'Two', 'Entry two',
+        '2019-01-02 00:00:00.000000')''',
+    '''INSERT INTO "Entry" VALUES (3, 'http://example.com/1', 1, 'One', 'Entry one, edited',
+        '2019-01-03 00:00:00.000000')'''
+]
+
+
+@pytest.fixture(scope='module')
+def connection(tmp_path_factory: pytest.TempPathFactory) -> Iterator[Connection]:
+    """Upgrades a database from the first version the way the app does on starting, yielding a connection to it."""
+
+    path: Path = tmp_path_factory.mktemp('storage') / 'feeds.sqlite'
+    old: Connection = connect(str(path))
+    for statement in OLD_SCHEMA + OLD_DATA:
+        old.execute(statement)
+    old.commit()
+    old.close()
+
+    configure_storage(db, PRAGMAS)
+    db.bind(provider='sqlite', filename=str(path))
+    migrate_storage(db, PRAGMAS)
+    db.generate_mapping(create_tables=True)
+    setup_search(db)
+
+    upgraded: Connection = connect(str(path))
+    yield upgraded
+    upgraded.close()
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """Picks the steps of a query plan that read every row of a table, rather than of a subquery's few results."""
+
+    scans: List[str] = [step for step in plan
+                         if step.startswith('SCAN') and 'INDEX' not in step and '(subquery' not in step]
+    return scans
+
+
+def query_plan(connection: Connection, sql: str) -> List[str]:
+    """Gets the query plan of a statement, with its parameters unset."""
+
+    plan: List[str] = [row[3] for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', [None] * sql.count('?'))]
+    return plan
+
+
+def test_upgraded_database_is_intact(connection: Connection) -> None:
+    assert connection.execute('PRAGMA integrity_check').fetchall() == [('ok',)]
+
+    # every index is of columns
+    for (index,) in connection.execute('SELECT name FROM sqlite_master WHERE type = \'index\''):
+        assert all(row[1] != -2 for row in connection.execute(f'PRAGMA index_xinfo("{index}")'))
+
+
+def test_entries_are_keyed_on_guid(connection: Connection) -> None:
+    table: str = connection.execute('SELECT sql FROM sqlite_master WHERE name = \'Entry\'').fetchone()[0]
+    assert 'unq_entry__source_link_title_updated' not in table
+    assert 'unq_entry__source_guid' in table
+
+    # only the newest of an edited entry is kept, and the next entry doesn't reuse an ID
+    entries: List[tuple] = connection.execute('SELECT "id", "guid", "excerpt" FROM "Entry" ORDER BY "id"').fetchall()
+    assert entries == [(2, 'http://example.com/2', 'Two'), (3, 'http://example.com/1', 'One')]
+    assert connection.execute('SELECT seq FROM sqlite_sequence WHERE name = \'Entry\'').fetchone() == (3,)
+
+
+def test_migration_runs_once(connection: Connection) -> None:
+    schema: List[tuple] = connection.execute('SELECT * FROM sqlite_master').fetchall()
+    migrate_storage(db, PRAGMAS)
+    assert connection.execute('SELECT * FROM sqlite_master').fetchall() == schema
+
+
+def test_timeline_is_read_through_indexes(connection: Connection) -> None:
+    with db_session:
+        user: UserModel = UserModel.get(name='user')
+        entries: list = select_timeline(user, None, None, 10)
+        plan: List[str] = query_plan(connection, db.last_sql)
+
+        # later pages are read from the cursor on
+        later_entries: list = select_timeline(user, (datetime(2019, 1, 3), 3), None, 10)
+        later_plan: List[str] = query_plan(connection, db.last_sql)
+
+    assert [entry.id for entry in entries] == [3, 2]
+    assert any('idx_sourceuserdata__user_source' in step for step in plan)
+    assert any('USING INDEX idx_entry__' in step for step in plan)
+    assert not full_scans(plan)
+
+    assert [entry.id for entry in later_entries] == [2]
+    assert any(step.startswith('SEARCH e USING INDEX idx_entry__updated (updated<?)') for step in later_plan)
+    assert not full_scans(later_plan)
+
+
+def test_materialized_timeline_pages_are_read_from_the_cursor(connection: Connection) -> None:
+    with db_session:
+        user: UserModel = UserModel.get(name='user')
+        db.merge_local_stats()
+        select_materialized_timeline(user, (datetime(2019, 1, 3), 3), None, 10)
+        sql: str = next(sql for sql in db.local_stats if sql and 'FROM "TimelineItem"' in sql)
+
+    plan: List[str] = query_plan(connection, sql)
+    assert any('USING INDEX idx_timelineitem__user_updated (user=? AND updated<?)' in step for step in plan)
+
+
+def test_filtered_timeline_is_read_through_indexes(connection: Connection) -> None:
+    with db_session:
+        user: UserModel = UserModel.get(name='user')
+        entries: list = select_timeline(user, (datetime(2019, 1, 3), 3), None, 10, [1, 2])
+        plan: List[str] = query_plan(connection, db.last_sql)
+
+    # each source is read newest first from the cursor on, a page's worth at most, rather than all its entries sorted
+    assert [entry.id for entry in entries] == [2]
+    assert [step for step in plan if step.startswith('SEARCH')] == \
+        ['SEARCH Entry USING INDEX idx_entry__source_updated (source=? AND updated<?)'] * 2
+    assert not full_scans(plan)
+
+
+def test_due_sources_are_found_through_an_index(connection: Connection) -> None:
+    next_due()
+    plan: List[str] = query_plan(connection, db.last_sql)
+    assert any('idx_source__next_check' in step for step in plan)
@@ -0,0 +1,94 @@
+# Copyright 2019 Matthew Bishop
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime
+from flask import current_app
+from pony.orm import (
+    Database,
+    db_session,
+    select)
+from typing import List
+
+from database import (
+    Entry as EntryModel,
+    Source as SourceModel,
+    SourceUserData as SourceUserDataModel,
+    TimelineItem as TimelineItemModel,
+    User as UserModel)
+
+
+# The materialized timeline is a copy of each user's (updated, entry) pairs, written when entries are stored, so reading
+# a timeline is a range scan of one user's rows rather than a join of every entry against their subscriptions.
+
+
+def add_to_timelines(entries: List[EntryModel], source: SourceModel) -> None:
+    """Adds new entries to the timelines of every user subscribed to their source. Must be called within a database
+    session.
+
+    :param entries: The new entries.
+    :param source: The source of the entries.
+    """
+
+    users: List[UserModel] = select(d.user for d in SourceUserDataModel if d.source == source)[:]
+    for user in users:
+        for entry in entries:
+            TimelineItemModel(entry=entry, updated=entry.updated, user=user)
+
+
+def backfill_timeline(user: UserModel, source: SourceModel) -> None:
+    """Adds the existing entries of a source to a user's timeline, when they subscribe to it. Must be called within a
+    database session.
+
+    :param user: The subscribing user.
+    :param source: The source subscribed to.
+    """
+
+    for entry_id, updated in select((e.id, e.updated) for e in EntryModel if e.source == source):
+        TimelineItemModel(entry=entry_id, updated=updated, user=user)
+
+
+def rebuild_timelines(db: Database) -> None:
+    """Rebuilds every user's materialized timeline from the entry and subscription tables, for when it's switched on
+    after entries have been stored without it.
+
+    :param db: The bound database.
+    """
+
+    with db_session:
+        db.execute('DELETE FROM "TimelineItem"')
+        db.execute('''INSERT INTO "TimelineItem" ("entry", "updated", "user")
+            SELECT "e"."id", "e"."updated", "d"."user" FROM "Entry" "e"
+            INNER JOIN "SourceUserData" "d" ON "d"."source" = "e"."source"''')
+
+
+def timeline_enabled() -> bool:
+    """Checks if the materialized timeline is switched on, with MATERIALIZED_TIMELINE.
+
+    :return: True if timelines should be written to and read from the timeline table.
+    """
+
+    enabled: bool = current_app.config['MATERIALIZED_TIMELINE']
+    return enabled
+
+
+def update_timelines(entry_id: int, updated: datetime) -> None:
+    """Moves a changed entry to its new place in every timeline it's in. Must be called within a database session.
+
+    :param entry_id: The ID of the changed entry.
+    :param updated: The entry's new updated time.
+    """
+
+    for item in select(t for t in TimelineItemModel if t.entry.id == entry_id):
+        item.updated = updated